@@ -12,9 +12,16 @@ See LICENSE for details.
 
 from __future__ import unicode_literals, division, print_function
 
+import os
+import time
 import math
-import copy
-from itertools import combinations
+import heapq
+import itertools
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+from skyrimdata import db
+from skyrimstructs import Effect
 
 
 #%% Utility functions
@@ -70,62 +77,272 @@ def powerFactor(mgef, making, alch_skill, fortify_alch=0, perks=[]):
              poisonerPerk(mgef, making, perks) / 100))
 
 
+def scaleEffect(effect, making, alch_skill, fortify_alch=0, perks=[]):
+    """Scale an ingredient effect by the player's alchemy power.
+
+    Returns a (magnitude, duration, value) tuple for the effect as part of a
+    potion or poison, depending on `making`.
+    """
+    mgef = effect.MGEF
+    pf = powerFactor(mgef, making, alch_skill, fortify_alch, perks)
+    return _scaleEffect(effect, mgef, pf)
+
+
+def _scaleEffect(effect, mgef, pf):
+    flags = mgef.MGEFflags.b
+    mag = round(effect.Magnitude * (pf if flags.PowerAffectsMagnitude else 1))
+    dur = round(effect.Duration * (pf if flags.PowerAffectsDuration else 1))
+    magfact = mag if mag > 0 else 1
+    durfact = dur/10 if dur > 0 else 1
+    value = math.floor(mgef.BaseCost * (magfact*durfact)**1.1)
+    return mag, dur, value
+
+
 #%% Alchemy classes
-class Recipe(object):
-    """Represents a recipe (combination of ingredients)."""
-    def __init__(self, alch_skill, fortify_alch=0, perks=[], ingrs=[]):
+class PerkProfile(object):
+    """Alchemy skill, Fortify Alchemy and perks, compiled once per search.
+
+    Power factors and scaled effects are memoized, so evaluating recipes
+    with the same profile is mostly table lookups.
+    """
+    def __init__(self, alch_skill, fortify_alch=0, perks=[]):
+        self.alch_skill = alch_skill
+        self.fortify_alch = fortify_alch
+        self.perks = frozenset(perks)
+        self.purity = 0x5821d in self.perks
+        self._factors = {}
+        self._effects = {}
+
+    def factor(self, mgef, making):
+        """Memoized powerFactor for a magic effect."""
+        key = (mgef.id, making)
         try:
-            ingrs.remove(None)
-        except ValueError:
-            pass
-        ingrs.sort(key=lambda x: x.Value, reverse=True)
-        self.ingrs = ingrs
-        effects = {}
-        for ingr in ingrs:
-            for ef in ingr.effects:
-                effects.setdefault(ef.MGEF.FullName, [ef, 0])[1]+=1
-        effects = {k: v for k,v in effects.items() if v[1] > 1}
-        effect_order = sorted([ef[0] for ef in effects.values()],
-                              key=lambda x: x.Value,
-                              reverse=True)
-        if 0 < len(effect_order) >= len(ingrs) - 1:
-            self.valid = True
+            return self._factors[key]
+        except KeyError:
+            pf = powerFactor(mgef, making, self.alch_skill,
+                             self.fortify_alch, self.perks)
+            self._factors[key] = pf
+            return pf
+
+    def scale(self, effect, making):
+        """Memoized scaleEffect: (magnitude, duration, value) of an effect."""
+        key = (effect.EffectID, effect.Magnitude, effect.Duration, making)
+        try:
+            return self._effects[key]
+        except KeyError:
+            mgef = effect.MGEF
+            stats = _scaleEffect(effect, mgef, self.factor(mgef, making))
+            self._effects[key] = stats
+            return stats
+
+    def __repr__(self):
+        return "PerkProfile<skill={}, fortify={}, perks={}>".format(
+            self.alch_skill, self.fortify_alch,
+            ", ".join("{:x}".format(perk) for perk in sorted(self.perks)))
+
+
+def sharedEffects(ingrs):
+    """Find the effects shared by a combination of ingredients.
+
+    Returns the ingredients sorted by value and their shared effects, most
+    valuable first, or None instead of the effects if the combination is not
+    a valid recipe. None ingredients are ignored. This part of evaluating a
+    recipe doesn't depend on skill or perks.
+    """
+    ingrs = sorted([ingr for ingr in ingrs if ingr is not None],
+                   key=lambda x: x.Value, reverse=True)
+    effects = {}
+    for ingr in ingrs:
+        for ef in ingr.effects:
+            effects.setdefault(ef.MGEF.FullName, [ef, 0])[1] += 1
+    effect_order = [ef for ef, count in effects.values() if count > 1]
+    effect_order.sort(key=lambda x: x.Value, reverse=True)
+    if not 0 < len(effect_order) >= len(ingrs) - 1:
+        return ingrs, None
+    return ingrs, effect_order
+
+
+class Recipe(object):
+    """Represents a recipe (combination of ingredients).
+
+    Recipes are immutable and only hold IDs and numbers. The `ingrs` and
+    `effects` properties build the game objects when needed. A PerkProfile
+    may be given to share its memoized values between recipes.
+    """
+    __slots__ = ('valid', 'Name', 'Value', 'ingr_ids', 'effect_ids',
+                 'magnitudes', 'durations')
+
+    def __init__(self, alch_skill, fortify_alch=0, perks=[], ingrs=[],
+                 profile=None):
+        if profile is None:
+            profile = PerkProfile(alch_skill, fortify_alch, perks)
+        ingrs, effect_order = sharedEffects(ingrs)
+        if effect_order is None:
+            self._set(False, "Invalid recipe", 0.,
+                      tuple(ingr.id for ingr in ingrs), (), (), ())
         else:
-            self.valid = False
-            self.Name = "Invalid recipe"
-            return
-        self.Name = "{} of {}".format(effect_order[0].MGEF.alch_type.capitalize(),
-                                      effect_order[0].MGEF.FullName)
-        effect_order = copy.deepcopy(effect_order)
+            self._evaluate(ingrs, effect_order, profile)
+
+    def _evaluate(self, ingrs, effect_order, profile):
+        lead = effect_order[0].MGEF
+        making = lead.alch_type
+        effect_ids = []
+        magnitudes = []
+        durations = []
         valuesum = 0.
-        making = effect_order[0].MGEF.alch_type
-        del_effect = []
         for effect in effect_order:
-            if 0x5821d in perks and effect.MGEF.alch_type != making:
-                del_effect.append(effect)
+            if profile.purity and effect.MGEF.alch_type != making:
                 continue  # skip if Purity perk
-            mgef = effect.MGEF
-            pf = powerFactor(mgef, making, alch_skill, fortify_alch, perks)
-            mag = round(effect.Magnitude * (pf if mgef.MGEFflags.b.PowerAffectsMagnitude else 1))
-            dur = round(effect.Duration * (pf if mgef.MGEFflags.b.PowerAffectsDuration else 1))
-            magfact = mag if mag > 0 else 1
-            durfact = dur/10 if dur > 0 else 1
-            value = math.floor(mgef.BaseCost * (magfact*durfact)**1.1)
+            mag, dur, value = profile.scale(effect, making)
             valuesum += value
-            effect.Magnitude = mag
-            effect.Duration = dur
+            effect_ids.append(effect.EffectID)
+            magnitudes.append(mag)
+            durations.append(dur)
+        self._set(True, "{} of {}".format(making.capitalize(), lead.FullName),
+                  valuesum, tuple(ingr.id for ingr in ingrs),
+                  tuple(effect_ids), tuple(magnitudes), tuple(durations))
+
+    def _set(self, *values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    @classmethod
+    def fromShared(cls, ingrs, effect_order, profile):
+        """Build a valid recipe from the result of `sharedEffects`."""
+        recipe = cls.__new__(cls)
+        recipe._evaluate(ingrs, effect_order, profile)
+        return recipe
+
+    @classmethod
+    def fromEvaluation(cls, ingr_ids, name, value, effect_ids, magnitudes,
+                       durations):
+        """Build a valid recipe from already computed results."""
+        recipe = cls.__new__(cls)
+        recipe._set(True, name, value, ingr_ids, effect_ids, magnitudes,
+                    durations)
+        return recipe
+
+    @classmethod
+    def fromColumns(cls, names, values, ingr_ids, effect_ids, magnitudes,
+                    durations):
+        """Build many valid recipes from columns of computed results.
+
+        Slots are filled a column at a time, which is much faster than
+        calling `fromEvaluation` for every recipe.
+        """
+        recipes = list(map(cls.__new__, itertools.repeat(cls, len(names))))
+        columns = (itertools.repeat(True), names, values, ingr_ids,
+                   effect_ids, magnitudes, durations)
+        for name, column in zip(cls.__slots__, columns):
+            collections.deque(map(getattr(cls, name).__set__, recipes,
+                                  column), maxlen=0)
+        return recipes
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Recipe objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Recipe objects are immutable")
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        self._set(*state)
 
-        for effect in del_effect:
-            effect_order.remove(effect)
+    @property
+    def ingrs(self):
+        return [db['INGR'][id_] for id_ in self.ingr_ids]
 
-        self.Value = valuesum
-        self.effects = effect_order
+    @property
+    def effects(self):
+        """Effects with the magnitude and duration of this recipe."""
+        effects = []
+        for id_, mag, dur in zip(self.effect_ids, self.magnitudes,
+                                 self.durations):
+            effect = Effect(id_)
+            effect.Magnitude = mag
+            effect.Duration = dur
+            effects.append(effect)
+        return effects
 
     def __repr__(self):
         return "Recipe<{}>".format(self.Name)
 
 
 #%%
+def compatibilityIndex(ingrs):
+    """Find which ingredients may be combined.
+
+    Returns a list with, for each ingredient, the set of indexes of the other
+    ingredients it shares at least one effect with.
+    """
+    by_effect = {}
+    everything = []
+    for i, ingr in enumerate(ingrs):
+        names = [ef.MGEF.FullName for ef in ingr.effects]
+        if len(set(names)) < len(names):
+            # Listing an effect twice shares it with any other ingredient
+            everything.append(i)
+        for name in set(names):
+            by_effect.setdefault(name, []).append(i)
+    compat = [set() for ingr in ingrs]
+    for members in by_effect.values():
+        for i in members:
+            compat[i].update(members)
+    for i in everything:
+        compat[i].update(range(len(ingrs)))
+        for adj in compat:
+            adj.add(i)
+    for i, adj in enumerate(compat):
+        adj.discard(i)
+    return compat
+
+
+def uniqueRecipes(recipes, ingrs, pairs=True):
+    """Filter valid recipes, skipping dominated and duplicate ones.
+
+    A triple is dominated when one of its pairs makes the very same recipe,
+    i.e. the third ingredient adds no effect and doesn't provide a stronger
+    version of one. Recipes with the same effects as an earlier one are
+    duplicates. `ingrs` must include all the ingredients used by the
+    recipes. Set `pairs` to False when no pair recipes were calculated
+    (calc2=False): the pair dominating a triple isn't among the recipes
+    then, so the triple is kept.
+    """
+    by_id = {}
+    names = {}
+    effect_names = {}
+    for ingr in ingrs:
+        by_id[ingr.id] = ingr
+        names[ingr.id] = set()
+        for ef in ingr.effects:
+            effect_names[ef.EffectID] = ef.MGEF.FullName
+            names[ingr.id].add(ef.MGEF.FullName)
+
+    def shared(ids):
+        effect_order = sharedEffects([by_id[id_] for id_ in ids])[1]
+        return [(ef.EffectID, ef.Magnitude, ef.Duration)
+                for ef in effect_order or ()]
+    seen = set()
+    for recipe in recipes:
+        if not recipe.valid:
+            continue
+        outcome = (recipe.effect_ids, recipe.magnitudes, recipe.durations)
+        if outcome in seen:
+            continue
+        if pairs and len(recipe.ingr_ids) == 3:
+            ids = recipe.ingr_ids
+            effects = set(effect_names[id_] for id_ in recipe.effect_ids)
+            members = [names[id_] for id_ in ids]
+            covering = [(ids[i-1], ids[i-2]) for i in range(3)
+                        if effects <= members[i-1] & members[i-2]]
+            if any(shared(pair) == shared(ids) for pair in covering):
+                continue
+        seen.add(outcome)
+        yield recipe
+
+
 class RecipeFactory(object):
     def __init__(self, ingrs=[]):
         self.ingrs = ingrs
@@ -138,35 +355,922 @@ class RecipeFactory(object):
     def ingrs(self, ingrs):
         ingrs.sort(key=lambda x: x.Value, reverse=True)
         self._ingrs = ingrs
+        self.compat = compatibilityIndex(ingrs)
 
-    def calcRecipesIter(self, alch_skill, fortify_alch=0, perks=[], calc2=True, calc3=True):
-        if calc2 and calc3:
-            ingrs = copy.copy(self._ingrs)
-            ingrs.append(None)
-            calc_n = 3
-        elif calc2 and not calc3:
-            ingrs = self._ingrs
-            calc_n = 2
-        elif not calc2 and calc3:
-            ingrs = self._ingrs
-            calc_n = 3
-        else:
+    def _thirds(self, a, b):
+        """Indexes which may complete the (a, b) pair into a valid triple."""
+        if b in self.compat[a]:
+            return range(b + 1, len(self._ingrs))
+        return sorted(c for c in self.compat[a] | self.compat[b] if c > b)
+
+    def combinationsIter(self, calc2=True, calc3=True, start=0, stop=None):
+        """Yield index tuples of the combinations which may be valid.
+
+        Only combinations where some pair of ingredients shares an effect are
+        generated, in the same order as `itertools.combinations`. `start` and
+        `stop` limit the range of the first ingredient index.
+        """
+        if not (calc2 or calc3):
             raise ValueError("One of calc2 or calc3 must be True")
-        for ingr_comb in combinations(ingrs, calc_n):
-            recipe = Recipe(alch_skill, fortify_alch, perks, list(ingr_comb))
+        compat = self.compat
+        n = len(self._ingrs)
+        for a in range(start, n if stop is None else stop):
+            for b in range(a + 1, n):
+                if calc3:
+                    for c in self._thirds(a, b):
+                        yield (a, b, c)
+                if calc2 and b in compat[a]:
+                    yield (a, b)
+
+    def countCombinations(self, calc2=True, calc3=True):
+        """Number of combinations yielded by `combinationsIter`."""
+        compat = self.compat
+        n = len(self._ingrs)
+        count = 0
+        for a in range(n):
+            for b in range(a + 1, n):
+                if calc3:
+                    count += len(self._thirds(a, b))
+                if calc2 and b in compat[a]:
+                    count += 1
+        return count
+
+    def calcRecipesIter(self, alch_skill, fortify_alch=0, perks=[], calc2=True,
+                        calc3=True, unique=False):
+        """Yield one Recipe per combination from `combinationsIter`.
+
+        With `unique`, only the recipes passing `uniqueRecipes` are yielded.
+        `combinationsDone` counts the combinations evaluated so far.
+        """
+        recipes = self._recipesIter(PerkProfile(alch_skill, fortify_alch,
+                                                perks), calc2, calc3)
+        if unique:
+            recipes = self.uniqueRecipes(recipes, calc2)
+        return recipes
+
+    def _recipesIter(self, profile, calc2, calc3):
+        ingrs = self._ingrs
+        self.combinationsDone = 0
+        for ingr_comb in self.combinationsIter(calc2, calc3):
+            recipe = Recipe(profile.alch_skill, profile.fortify_alch,
+                            profile.perks, [ingrs[i] for i in ingr_comb],
+                            profile)
+            self.combinationsDone += 1
             yield recipe
 
-    def calcRecipes(self, alch_skill, fortify_alch=0, perks=[], calc2=True, calc3=True):
+    def uniqueRecipes(self, recipes, pairs=True):
+        """Filter valid recipes, skipping dominated and duplicate ones.
+
+        See the module-level `uniqueRecipes`.
+        """
+        return uniqueRecipes(recipes, self._ingrs, pairs)
+
+    def topRecipes(self, k, alch_skill, fortify_alch=0, perks=[], calc2=True,
+                   calc3=True):
+        """Find the `k` most valuable recipes.
+
+        Gives the same result as ``calcRecipes(...)[:k]`` with a branch and
+        bound search: combinations whose value upper bound can't beat the
+        current k-th best recipe are never built.
+        """
+        if not (calc2 or calc3):
+            raise ValueError("One of calc2 or calc3 must be True")
+        ingrs = self._ingrs
+        compat = self.compat
+        n = len(ingrs)
+        profile = PerkProfile(alch_skill, fortify_alch, perks)
+        # Highest value each effect may have in any recipe
+        best = {}
+        for ingr in ingrs:
+            for ef in ingr.effects:
+                value = max(profile.scale(ef, making)[2]
+                            for making in ("potion", "poison"))
+                name = ef.MGEF.FullName
+                best[name] = max(best.get(name, 0), value)
+        # Every shared effect comes from at least two ingredients, so a
+        # recipe is worth at most the potentials of its two weakest ones.
+        # An ingredient listing an effect twice shares it on its own, so
+        # recipes with one are bounded by the potentials of all members.
+        potential = []
+        dup = []
+        for ingr in ingrs:
+            names = set(ef.MGEF.FullName for ef in ingr.effects)
+            potential.append(sum(best[name] for name in names))
+            dup.append(len(names) < len(ingr.effects))
+        order = sorted(range(n), key=lambda i: potential[i], reverse=True)
+        regular = [i for i in order if not dup[i]]
+        bound = [potential[i] for i in regular] + [-1, -1]
+
+        heap = []  # (Value, reversed position in calcRecipes, Recipe)
+
+        def consider(members):
+            members.sort()
+            recipe = Recipe(alch_skill, fortify_alch, perks,
+                            [ingrs[i] for i in members], profile)
+            if not recipe.valid:
+                return
+            rank = tuple(-i for i in members) + ((-n,) if len(members) == 2
+                                                 else ())
+            entry = (recipe.Value, rank, recipe)
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+
+        def beaten(value):
+            return len(heap) == k and value < heap[0][0]
+
+        for p in range(len(regular)):
+            if beaten(max(bound[p+1] + bound[p+2] if calc3 else -1,
+                          bound[p+1] if calc2 else -1)):
+                break
+            a = regular[p]
+            for q in range(p + 1, len(regular)):
+                if beaten(max(bound[q] + bound[q+1] if calc3 else -1,
+                              bound[q] if calc2 else -1)):
+                    break
+                b = regular[q]
+                ab = b in compat[a]
+                if calc2 and ab and not beaten(bound[q]):
+                    consider([a, b])
+                if not calc3:
+                    continue
+                for r in range(q + 1, len(regular)):
+                    if beaten(bound[q] + bound[r]):
+                        break
+                    c = regular[r]
+                    if ab or c in compat[a] or c in compat[b]:
+                        consider([a, b, c])
+        done = set()
+        for d in order:
+            if not dup[d]:
+                continue
+            done.add(d)
+            others = [i for i in order if i not in done]
+            rest = [potential[i] for i in others] + [0]
+            for q, b in enumerate(others):
+                if beaten(potential[d] + rest[q] + (rest[q+1] if calc3
+                                                    else 0)):
+                    break
+                if calc2 and not beaten(potential[d] + rest[q]):
+                    consider([d, b])
+                if not calc3:
+                    continue
+                for r in range(q + 1, len(others)):
+                    if beaten(potential[d] + rest[q] + rest[r]):
+                        break
+                    consider([d, b, others[r]])
+        heap.sort(reverse=True)
+        return [recipe for value, rank, recipe in heap]
+
+    def shards(self, count):
+        """Split the first ingredient index range in `count` (start, stop)
+        ranges with about the same number of combinations each."""
+        n = len(self._ingrs)
+        weights = [(n - a) * (n - a - 1) // 2 + 1 for a in range(n)]
+        total = sum(weights)
+        shards = []
+        start = 0
+        done = 0
+        for a, weight in enumerate(weights):
+            done += weight
+            if done * count >= total * (len(shards) + 1):
+                shards.append((start, a + 1))
+                start = a + 1
+        if start < n:
+            shards.append((start, n))
+        return shards
+
+    def calcRecipesParallel(self, alch_skill, fortify_alch=0, perks=[],
+                            calc2=True, calc3=True, workers=None,
+                            mp_context=None):
+        """Calculate all valid recipes in a pool of `workers` processes.
+
+        Valid recipes are returned in combination order, like the ones from
+        `calcRecipesIter`. `workers` defaults to the number of CPUs. Workers
+        are given the ingredients and their magic effects, so they need no
+        game data and may be spawned (see `mp_context` of
+        ProcessPoolExecutor) rather than forked.
+        """
+        ingrs = self._ingrs
+        mgefs = {ef.EffectID: ef.MGEF for ingr in ingrs for ef in ingr.effects}
+        shards = self.shards(4 * (workers or os.cpu_count() or 1))
         recipes = []
-        for recipe in self.calcRecipesIter(alch_skill, fortify_alch, perks,
-                                           calc2, calc3):
-            if recipe.valid:
-                recipes.append(recipe)
-        recipes.sort(key=lambda x: x.Value, reverse=True)
+        with ProcessPoolExecutor(workers, mp_context=mp_context,
+                                 initializer=_initRecipeWorker,
+                                 initargs=(mgefs, ingrs)) as pool:
+            profile = PerkProfile(alch_skill, fortify_alch, perks)
+            jobs = [pool.submit(_calcRecipesShard, start, stop, profile,
+                                calc2, calc3)
+                    for start, stop in shards]
+            for job in jobs:  # Merge in order
+                recipes.extend(job.result())
+        return recipes
+
+    def calcRecipes(self, alch_skill, fortify_alch=0, perks=[], calc2=True,
+                    calc3=True, engine="python", workers=1, unique=False):
+        """Calculate all valid recipes, most valuable first.
+
+        `engine` may be "python" (one Recipe per combination) or "numpy"
+        (bulk array evaluation, same results). The python engine runs in
+        `workers` processes (None for one per CPU). With `unique`, dominated
+        and duplicate recipes are left out (see `uniqueRecipes`).
+        """
+        if engine == "numpy":
+            recipes = calcRecipesNumpy(self._ingrs, alch_skill, fortify_alch,
+                                       perks, calc2, calc3)
+        elif engine != "python":
+            raise ValueError("Unknown recipe engine: {}".format(engine))
+        elif workers == 1:
+            recipes = [recipe for recipe in
+                       self.calcRecipesIter(alch_skill, fortify_alch, perks,
+                                            calc2, calc3)
+                       if recipe.valid]
+            recipes.sort(key=lambda x: x.Value, reverse=True)
+        else:
+            recipes = self.calcRecipesParallel(alch_skill, fortify_alch,
+                                               perks, calc2, calc3, workers)
+            recipes.sort(key=lambda x: x.Value, reverse=True)
+        if unique:
+            # Sorting is stable, so duplicates still come in combination
+            # order and the same recipes are kept as with calcRecipesIter.
+            recipes = list(self.uniqueRecipes(recipes, calc2))
         self.recipes = recipes
         return recipes
 
+    def valueCurves(self, skills=range(15, 101), fortify=(0,), perk_sets=((),),
+                    recipes=None, calc2=True, calc3=True):
+        """Values of a fixed set of recipes over a grid of alchemy setups.
+
+        Every combination of `skills`, `fortify` (Fortify Alchemy) and
+        `perk_sets` is evaluated in one NumPy pass (see `valueCurvesNumpy`).
+        `recipes` defaults to all the valid recipes of the ingredients, which
+        are only combined and checked once.
+
+        Returns the ingredient id tuples of the recipes and an array of values
+        shaped (recipes, skills, fortify, perk sets), so ``values[i, :, 0, 0]``
+        is how the value of recipe i grows with skill.
+        """
+        if recipes is None:
+            ingrs = self._ingrs
+            shared = []
+            for ingr_comb in self.combinationsIter(calc2, calc3):
+                members, effect_order = sharedEffects(
+                    [ingrs[i] for i in ingr_comb])
+                if effect_order is not None:
+                    shared.append((members, effect_order))
+        else:
+            shared = [sharedEffects(recipe.ingrs) for recipe in recipes]
+        values = valueCurvesNumpy(shared, skills, fortify, perk_sets)
+        return [tuple(ingr.id for ingr in members)
+                for members, effect_order in shared], values
+
+
+class RecipeStore(object):
+    """Keeps the recipes for a changing set of ingredients up to date.
+
+    Adding an ingredient only evaluates the combinations which include it,
+    removing one only drops its recipes, and a new PerkProfile only rescales
+    the shared effects already found, so reloading a save or changing skill
+    doesn't redo the whole enumeration.
+    """
+    def __init__(self, profile, calc2=True, calc3=True):
+        if not (calc2 or calc3):
+            raise ValueError("One of calc2 or calc3 must be True")
+        self.profile = profile
+        self.calc2 = calc2
+        self.calc3 = calc3
+        self._ingrs = {}  # {id: INGR}, in rank order for ties
+        self._names = {}  # {id: (effect names, has duplicated effect)}
+        self._shared = {}  # {frozenset(ids): (ingrs, effect_order)}
+        self._recipes = {}  # {frozenset(ids): Recipe}
+
+    @property
+    def ingrs(self):
+        return list(self._ingrs.values())
+
+    def _compatible(self, a, b):
+        names_a, dup_a = self._names[a]
+        names_b, dup_b = self._names[b]
+        return dup_a or dup_b or not names_a.isdisjoint(names_b)
+
+    def _rank(self):
+        ingrs = sorted(self._ingrs.values(), key=lambda x: x.Value,
+                       reverse=True)
+        return dict((ingr.id, i) for i, ingr in enumerate(ingrs))
+
+    def _evaluate(self, members, rank):
+        members = sorted(members, key=lambda x: rank[x.id])
+        ingrs, effect_order = sharedEffects(members)
+        if effect_order is not None:
+            key = frozenset(ingr.id for ingr in ingrs)
+            self._shared[key] = (ingrs, effect_order)
+            self._recipes[key] = Recipe.fromShared(ingrs, effect_order,
+                                                   self.profile)
+
+    def _register(self, ingr):
+        self._ingrs[ingr.id] = ingr
+        names = [ef.MGEF.FullName for ef in ingr.effects]
+        self._names[ingr.id] = (set(names), len(set(names)) < len(names))
+
+    def addIngredient(self, ingr):
+        """Add an ingredient, evaluating only the combinations with it."""
+        if ingr.id in self._ingrs:
+            return
+        others = list(self._ingrs)
+        self._register(ingr)
+        self._combine(ingr, others, self._rank())
+
+    def _combine(self, ingr, others, rank):
+        """Evaluate the combinations of `ingr` with the `others` ids."""
+        compat = [self._compatible(ingr.id, other) for other in others]
+        for i, other in enumerate(others):
+            if self.calc2 and compat[i]:
+                self._evaluate((ingr, self._ingrs[other]), rank)
+            if not self.calc3:
+                continue
+            for j in range(i + 1, len(others)):
+                if (compat[i] or compat[j] or
+                        self._compatible(other, others[j])):
+                    self._evaluate((ingr, self._ingrs[other],
+                                    self._ingrs[others[j]]), rank)
+
+    def removeIngredient(self, ingr_id):
+        """Remove an ingredient and the recipes using it."""
+        if self._ingrs.pop(ingr_id, None) is None:
+            return
+        del self._names[ingr_id]
+        for key in [key for key in self._shared if ingr_id in key]:
+            del self._shared[key]
+            del self._recipes[key]
+
+    def setProfile(self, profile):
+        """Rescale the recipes if skill, fortify or perks changed."""
+        old = self.profile
+        self.profile = profile
+        if ((old.alch_skill, old.fortify_alch, old.perks) ==
+                (profile.alch_skill, profile.fortify_alch, profile.perks)):
+            return
+        for key, (ingrs, effect_order) in self._shared.items():
+            self._recipes[key] = Recipe.fromShared(ingrs, effect_order,
+                                                   profile)
+
+    def update(self, ingrs, profile=None):
+        """Change the ingredients (and profile) to the given ones.
+
+        Ingredients no longer present are removed before rescaling, so only
+        recipes that will be kept are recalculated.
+        """
+        ingrs = dict((ingr.id, ingr) for ingr in ingrs)
+        for ingr_id in list(self._ingrs):
+            if ingr_id not in ingrs:
+                self.removeIngredient(ingr_id)
+        others = list(self._ingrs)
+        added = [ingr for ingr_id, ingr in ingrs.items()
+                 if ingr_id not in self._ingrs]
+        # Follow the given order for ties in value, like RecipeFactory
+        self._ingrs = dict((ingr_id, self._ingrs.get(ingr_id, ingr))
+                           for ingr_id, ingr in ingrs.items())
+        for ingr in added:
+            self._register(ingr)
+        rank = self._rank()
+        # Tied ingredients may have been reordered, which changes what the
+        # first of them contributes to a recipe
+        for members, effect_order in list(self._shared.values()):
+            ranks = [rank[ingr.id] for ingr in members]
+            if ranks != sorted(ranks):
+                self._evaluate(members, rank)
+        if profile is not None:
+            self.setProfile(profile)
+        for ingr in added:
+            self._combine(ingr, others, rank)
+            others.append(ingr.id)
+
+    def recipes(self, unique=False):
+        """Valid recipes, most valuable first.
+
+        Ties keep the order of `RecipeFactory.calcRecipes`. With `unique`,
+        dominated and duplicate recipes are left out (see `uniqueRecipes`).
+        """
+        rank = self._rank()
+        n = len(rank)
+
+        def order(recipe):
+            key = sorted(rank[id_] for id_ in recipe.ingr_ids)
+            if len(key) == 2:
+                key.append(n)  # Pairs come after triples starting the same
+            return (-recipe.Value, key)
+        recipes = sorted(self._recipes.values(), key=order)
+        if unique:
+            recipes = list(uniqueRecipes(recipes, self.ingrs, self.calc2))
+        return recipes
+
+
+#%% Batch brewing
+def planBrewing(recipes, stock, time_limit=5.):
+    """Choose how many times to brew each recipe with the ingredients owned.
+
+    `stock` maps ingredient IDs to counts (see `Savegame.player_ingrs`).
+    Starts from the best of two greedy plans (by value and by value per
+    ingredient), then improves it with local search: brew one potion less
+    and refill the freed ingredients greedily, keeping the change if the
+    total grows. Stops when no move helps or after `time_limit` seconds.
+
+    Returns the plan as a list of (Recipe, count), most valuable recipe
+    first, and its total value.
+    """
+    stock = {id_: count for id_, count in stock.items() if count > 0}
+    recipes = [recipe for recipe in recipes if recipe.valid and
+               all(id_ in stock for id_ in recipe.ingr_ids)]
+    by_pair = {}  # Recipes using both ingredients of a pair
+    for n, recipe in enumerate(recipes):
+        ids = sorted(recipe.ingr_ids)
+        for i, id_ in enumerate(ids):
+            for other in ids[i+1:]:
+                by_pair.setdefault((id_, other), []).append(n)
+
+    def fill(order, left, plan):
+        """Brew recipes in `order` as many times as `left` allows."""
+        gained = 0.
+        for n in order:
+            ids = recipes[n].ingr_ids
+            times = min(left[id_] for id_ in ids)
+            if times > 0:
+                for id_ in ids:
+                    left[id_] -= times
+                plan[n] = plan.get(n, 0) + times
+                gained += times * recipes[n].Value
+        return gained
+
+    best = None
+    for key in (lambda n: recipes[n].Value,
+                lambda n: recipes[n].Value / len(recipes[n].ingr_ids)):
+        order = sorted(range(len(recipes)), key=key, reverse=True)
+        left = dict(stock)
+        plan = {}
+        total = fill(order, left, plan)
+        if best is None or total > best[0]:
+            best = (total, plan, left, order)
+    total, plan, left, order = best
+    rank = {n: pos for pos, n in enumerate(order)}
+
+    deadline = time.time() + time_limit
+    improved = True
+    while improved and time.time() < deadline:
+        improved = False
+        for n in list(plan):
+            if n not in plan:
+                continue
+            ids = recipes[n].ingr_ids
+            trial_left = dict(left)
+            for id_ in ids:
+                trial_left[id_] += 1
+            trial_plan = dict(plan)
+            trial_plan[n] -= 1
+            if not trial_plan[n]:
+                del trial_plan[n]
+            # Only recipes made of freed and leftover ingredients may fit
+            available = [id_ for id_, count in trial_left.items() if count]
+            candidates = set()
+            for id_ in ids:
+                for other in available:
+                    pair = (id_, other) if id_ < other else (other, id_)
+                    candidates.update(by_pair.get(pair, ()))
+            candidates.discard(n)
+            candidates = sorted(candidates, key=rank.get)
+            gain = fill(candidates, trial_left, trial_plan) - recipes[n].Value
+            if gain > 0:
+                plan, left = trial_plan, trial_left
+                total += gain
+                improved = True
+            if time.time() > deadline:
+                break
+    brews = sorted(plan.items(), key=lambda item: rank[item[0]])
+    return [(recipes[n], count) for n, count in brews], total
+
+
+#%% Process pool workers
+_worker_factory = None
+
+
+def _initRecipeWorker(mgefs, ingrs):
+    """Set up a worker from the {EffectID: MGEF} table and ingredients.
+
+    The magic effects go in the worker's db, where Effect.MGEF looks them
+    up, so nothing is loaded from the game data files.
+    """
+    for effect_id, mgef in mgefs.items():
+        db['MGEF'][effect_id] = mgef
+    global _worker_factory
+    _worker_factory = RecipeFactory(ingrs)
+
+
+def _calcRecipesShard(start, stop, profile, calc2, calc3):
+    """Evaluate one shard of combinations, returning the valid recipes."""
+    ingrs = _worker_factory.ingrs
+    recipes = []
+    for comb in _worker_factory.combinationsIter(calc2, calc3, start, stop):
+        recipe = Recipe(profile.alch_skill, profile.fortify_alch,
+                        profile.perks, [ingrs[i] for i in comb], profile)
+        if recipe.valid:
+            recipes.append(recipe)
+    return recipes
+
+
+#%% Vectorized engine
+def calcRecipesNumpy(ingrs, alch_skill, fortify_alch=0, perks=[], calc2=True,
+                     calc3=True, chunk_cells=1 << 22):
+    """Calculate all valid recipes with NumPy array operations.
+
+    Builds one ingredient x effect incidence matrix and checks every pair and
+    triple in bulk, giving the same recipes (and order) as
+    `RecipeFactory.calcRecipes`. `ingrs` must be sorted by Value, as done by
+    `RecipeFactory`.
+    """
+    import numpy as np
+    if not (calc2 or calc3):
+        raise ValueError("One of calc2 or calc3 must be True")
+    n = len(ingrs)
+    profile = PerkProfile(alch_skill, fortify_alch, perks)
+    purity = profile.purity
+    # Effects are keyed by name, like Recipe does
+    columns = {}
+    for ingr in ingrs:
+        for ef in ingr.effects:
+            columns.setdefault(ef.MGEF.FullName, len(columns))
+    n_eff = len(columns)
+    if n < 2 or n_eff == 0:
+        return []
+    # Row n is all zeros and stands for the "no ingredient" placeholder
+    count = np.zeros((n + 1, n_eff), dtype=np.int8)
+    slot = np.zeros((n + 1, n_eff), dtype=np.int8)
+    base = np.zeros((n + 1, n_eff))
+    poison = np.zeros((n + 1, n_eff), dtype=bool)
+    value = np.zeros((n + 1, n_eff, 2))
+    effect_id = np.zeros((n + 1, n_eff), dtype=np.int64)
+    # Magnitude and duration by making (potion, poison)
+    scaled = np.zeros((n + 1, n_eff, 2, 2), dtype=np.int64)
+    sources = [{} for i in range(n)]  # column -> Effect
+    n_slots = 1
+    for i, ingr in enumerate(ingrs):
+        n_slots = max(n_slots, len(ingr.effects))
+        for s, ef in enumerate(ingr.effects):
+            col = columns[ef.MGEF.FullName]
+            count[i, col] += 1
+            if col in sources[i]:
+                continue
+            stats = (profile.scale(ef, "potion"), profile.scale(ef, "poison"))
+            sources[i][col] = ef
+            slot[i, col] = s
+            base[i, col] = ef.Value
+            poison[i, col] = ef.MGEF.alch_type == "poison"
+            value[i, col] = [stats[0][2], stats[1][2]]
+            effect_id[i, col] = ef.EffectID
+            scaled[i, col] = [stats[0][:2], stats[1][:2]]
+    # Upper bound on shared effects of each pair, to skip hopeless candidates
+    present = (count > 0).astype(np.int32)
+    shared = present.dot(present.T)
+    selfshared = (count > 1).sum(axis=1)
+
+    # Candidate combinations as (a, b, c) index arrays, c == n for pairs
+    blocks = []
+    if calc3:
+        m = n + 1 if calc2 else n
+        rows_b, rows_c = np.triu_indices(m, 1)
+        row_start = 0
+        for a in range(m - 2):
+            row_start += m - 1 - a
+            b, c = rows_b[row_start:], rows_c[row_start:]
+            members = np.where(c == n, 2, 3)
+            bound = (shared[a, b] + shared[a, c] + shared[b, c] +
+                     selfshared[a] + selfshared[b] + selfshared[c])
+            keep = bound >= members - 1
+            blocks.append((np.full(keep.sum(), a), b[keep], c[keep]))
+    else:
+        a, b = np.triu_indices(n, 1)
+        keep = shared[a, b] + selfshared[a] + selfshared[b] >= 1
+        blocks.append((a[keep], b[keep], np.full(keep.sum(), n)))
+    A = np.concatenate([blk[0] for blk in blocks])
+    B = np.concatenate([blk[1] for blk in blocks])
+    C = np.concatenate([blk[2] for blk in blocks])
+
+    # Shared effects of the valid combinations, one entry per (row, column)
+    results = []
+    chunk = max(1, chunk_cells // n_eff)
+    rows_done = 0
+    for start in range(0, len(A), chunk):
+        a, b, c = A[start:start+chunk], B[start:start+chunk], C[start:start+chunk]
+        active = count[a].astype(np.int16) + count[b] + count[c] > 1
+        n_active = active.sum(axis=1)
+        members = np.where(c == n, 2, 3)
+        valid = (n_active > 0) & (n_active >= members - 1)
+        a, b, c = a[valid], b[valid], c[valid]
+        row, col = np.nonzero(active[valid])
+        # The first ingredient having an effect provides it
+        in_a = count[a[row], col] > 0
+        in_b = count[b[row], col] > 0
+        pos = np.where(in_a, 0, np.where(in_b, 1, 2))
+        src = np.where(in_a, a[row], np.where(in_b, b[row], c[row]))
+        results.append((a, b, c, row + rows_done, col, pos, src))
+        rows_done += len(a)
+    if not rows_done:
+        return []
+
+    a, b, c, row, col, pos, src = [
+        np.concatenate(arrays) for arrays in zip(*results)]
+    n_rows = len(a)
+    # Order effects by base value, ties by order of appearance
+    order = np.lexsort((pos * n_slots + slot[src, col], -base[src, col], row))
+    row, col, src = row[order], col[order], src[order]
+    n_active = np.bincount(row, minlength=n_rows)
+    first = np.cumsum(n_active) - n_active
+    # Recipes are named after their most valuable effect
+    lead = src[first] * n_eff + col[first]
+    making = poison[src[first], col[first]]
+    making_row = making[row]
+    if purity:
+        kept = poison[src, col] == making_row
+    else:
+        kept = np.ones(len(row), dtype=bool)
+    making_row = making_row.astype(np.intp)
+    total = np.bincount(row, np.where(kept, value[src, col, making_row], 0),
+                        minlength=n_rows)
+    row, col, src, making_row = (row[kept], col[kept], src[kept],
+                                 making_row[kept])
+    n_kept = np.bincount(row, minlength=n_rows)
+    k = np.arange(len(row)) - (np.cumsum(n_kept) - n_kept)[row]
+    effect_table = np.zeros((n_rows, n_kept.max(), 3), dtype=np.int64)
+    effect_table[row, k, 0] = effect_id[src, col]
+    effect_table[row, k, 1:] = scaled[src, col, making_row]
+
+    # Most valuable first, ties in combination order like calcRecipes
+    perm = np.lexsort((c, b, a, -total))
+    ids = np.array([ingr.id for ingr in ingrs] + [0], dtype=np.int64)
+    members = np.stack([ids[a], ids[b], ids[c]], axis=1)[perm]
+    ingr_ids, = _rowTuples(members[:, :, None], np.where(c == n, 2, 3)[perm])
+    effect_ids, magnitudes, durations = _rowTuples(effect_table[perm],
+                                                   n_kept[perm])
+    leads, lead = np.unique(lead[perm], return_inverse=True)
+    names = []
+    for code in leads.tolist():
+        mgef = sources[code // n_eff][code % n_eff].MGEF
+        names.append("{} of {}".format(mgef.alch_type.capitalize(),
+                                       mgef.FullName))
+    names = [names[i] for i in lead.tolist()]
+    return Recipe.fromColumns(names, total[perm].tolist(), ingr_ids,
+                              effect_ids, magnitudes, durations)
+
+
+def _rowTuples(table, lengths):
+    """Tuples of the first `lengths[i]` items of each row of `table`.
+
+    `table` is shaped (rows, width, fields) and a list of row tuples is
+    returned for each field.
+    """
+    import numpy as np
+    tuples = [[] for field in range(table.shape[2])]
+    rows = []
+    for length in np.unique(lengths).tolist():
+        rows.append(np.flatnonzero(lengths == length))
+        block = table[rows[-1], :length].T.tolist()
+        for field, columns in zip(tuples, block):
+            field.extend(zip(*columns))
+    # Back from grouped by length to row order
+    order = np.argsort(np.concatenate(rows), kind='stable').tolist()
+    return [list(map(field.__getitem__, order)) for field in tuples]
+
+
+def valueCurvesNumpy(shared, skills, fortify=(0,), perk_sets=((),)):
+    """Evaluate recipes for many skill, Fortify Alchemy and perk values.
+
+    `shared` is a list of `sharedEffects` results. The power factor of each
+    distinct effect is computed for the whole grid at once, in the same
+    operation order as `powerFactor` so values match `Recipe` exactly.
+    Returns an array shaped (recipes, skills, fortify, perk sets).
+    """
+    import numpy as np
+    skills = np.asarray(skills, dtype=float)
+    fortify = np.asarray(fortify, dtype=float)
+    perk_sets = [frozenset(perks) for perks in perk_sets]
+    width = max([len(effect_order) for ingrs, effect_order in shared
+                 if effect_order is not None] + [0])
+    # Distinct effects, keyed like PerkProfile.scale
+    columns = {}
+    effects = []
+    index = np.full((len(shared), width), -1, dtype=np.intp)
+    poison = np.zeros((len(shared), width), dtype=bool)
+    making = np.zeros(len(shared), dtype=np.intp)  # 0 potion, 1 poison
+    for r, (ingrs, effect_order) in enumerate(shared):
+        if effect_order is None:
+            continue
+        making[r] = effect_order[0].MGEF.alch_type == "poison"
+        for k, ef in enumerate(effect_order):
+            key = (ef.EffectID, ef.Magnitude, ef.Duration)
+            if key not in columns:
+                columns[key] = len(effects)
+                effects.append(ef)
+            index[r, k] = columns[key]
+            poison[r, k] = ef.MGEF.alch_type == "poison"
+    n_eff = len(effects)
+    used = index >= 0
+    index[~used] = n_eff  # Extra row of zero values
+    mgefs = [ef.MGEF for ef in effects]
+    magnitude = np.array([ef.Magnitude for ef in effects], dtype=float)
+    duration = np.array([ef.Duration for ef in effects], dtype=float)
+    cost = np.array([mgef.BaseCost for mgef in mgefs], dtype=float)
+    by_mag = np.array([bool(mgef.MGEFflags.b.PowerAffectsMagnitude)
+                       for mgef in mgefs], dtype=bool)
+    by_dur = np.array([bool(mgef.MGEFflags.b.PowerAffectsDuration)
+                       for mgef in mgefs], dtype=bool)
+    # Skill and Fortify Alchemy part of powerFactor
+    grid = 4. * (1 + (1.5 - 1) * skills[:, None] / 100) * (1 + fortify / 100)
+    shape = (n_eff + 1, 2, len(skills), len(fortify))
+
+    values = np.zeros((len(shared), len(skills), len(fortify),
+                       len(perk_sets)))
+    for p, perks in enumerate(perk_sets):
+        physician = np.array([physicianPerk(mgef, perks) for mgef in mgefs],
+                             dtype=float)
+        maker = np.array([[1 + benefactorPerk(mgef, mk, perks) / 100 +
+                           poisonerPerk(mgef, mk, perks) / 100
+                           for mk in ("potion", "poison")]
+                          for mgef in mgefs], dtype=float).reshape(n_eff, 2)
+        pf = (grid * (1 + alchemistPerk(perks) / 100) *
+              (1 + physician / 100)[:, None, None, None] *
+              maker[:, :, None, None])
+        mag = np.rint(magnitude[:, None, None, None] *
+                      np.where(by_mag[:, None, None, None], pf, 1))
+        dur = np.rint(duration[:, None, None, None] *
+                      np.where(by_dur[:, None, None, None], pf, 1))
+        magfact = np.where(mag > 0, mag, 1)
+        durfact = np.where(dur > 0, dur / 10, 1)
+        effect_values = np.zeros(shape)
+        effect_values[:n_eff] = np.floor(
+            cost[:, None, None, None] * (magfact * durfact) ** 1.1)
+        kept = used
+        if 0x5821d in perks:
+            kept = used & (poison == making[:, None].astype(bool))
+        total = values[..., p]
+        for k in range(width):
+            total += (effect_values[index[:, k], making] *
+                      kept[:, k, None, None])
+    return values
+
+
 #%% Tests
+def _testIngredients(spec=None):
+    """Made-up magic effects and ingredients, for tests without game data.
+
+    They are added to db. `spec` lists (name, value, effect indexes) of the
+    ingredients; by default in the A, B, C triple the C adds no effect.
+    """
+    from skyrimstructs import MGEF, INGR
+    mgefs = [("Restore Health", 0x200000, 0.5),
+             ("Fortify Block", 0x600000, 0.5), ("Paralysis", 0x400005, 500.),
+             ("Damage Health", 0x200005, 3.),
+             ("Restore Magicka", 0x200000, 0.6), ("Slow", 0x400005, 1.),
+             ("Cure Disease", 0, 0.5)]
+    for i, (name, flags, cost) in enumerate(mgefs):
+        mgef = MGEF.__new__(MGEF)
+        mgef.__dict__.update(type="MGEF", id=0xFE000100 + i, FullName=name,
+                             Flags=flags, BaseCost=cost, KWDA=[],
+                             Description="<mag> for <dur> seconds")
+        db['MGEF'][mgef.id] = mgef
+    ingrs = []
+    if spec is None:
+        spec = [("A", 10, [0, 1, 2]), ("B", 8, [0, 1, 3]), ("C", 6, [0, 5]),
+                ("D", 4, [2, 3, 5]), ("E", 2, [3, 4]), ("F", 1, [4, 6])]
+    for i, (name, value, effects) in enumerate(spec):
+        ingr = INGR.__new__(INGR)
+        ingr.__dict__.update(type="INGR", id=0xFE000200 + i, FullName=name,
+                             Value=value, Weight=0.1, effects=[])
+        for e in effects:
+            effect = Effect(0xFE000100 + e)
+            effect.Magnitude = 1 + e
+            effect.Duration = 10 * (e % 3)
+            ingr.effects.append(effect)
+        db['INGR'][ingr.id] = ingr
+        ingrs.append(ingr)
+    return ingrs
+
+
+def test_uniqueRecipes():
+    ingrs = _testIngredients()
+    abc = tuple(ingr.id for ingr in ingrs[:3])
+    rf = RecipeFactory(list(ingrs))
+    assert abc in [r.ingr_ids for r in rf.calcRecipes(100)]
+    # Dominated by the A, B pair
+    assert abc not in [r.ingr_ids for r in rf.calcRecipes(100, unique=True)]
+    # Unless pairs aren't calculated
+    triples = [r.ingr_ids for r in rf.calcRecipes(100, calc2=False,
+                                                  unique=True)]
+    assert abc in triples
+    assert sorted(triples) == sorted(
+        r.ingr_ids for r in rf.calcRecipesIter(100, calc2=False, unique=True))
+    store = RecipeStore(PerkProfile(100), calc2=False)
+    store.update(ingrs)
+    assert [r.ingr_ids for r in store.recipes(True)] == triples
+
+
+def test_uniqueRecipesStronger():
+    # X adds no effect to the Y, Z pair but has a stronger Restore Health
+    ingrs = _testIngredients([("X", 10, [0]), ("Y", 8, [0, 1]),
+                              ("Z", 6, [0, 1])])
+    ingrs[0].effects[0].Magnitude = 10
+    xyz = tuple(ingr.id for ingr in ingrs)
+    rf = RecipeFactory(list(ingrs))
+    recipes = rf.calcRecipes(100, unique=True)
+    assert recipes[0].ingr_ids == xyz
+    assert recipes[0].Value > max(r.Value for r in recipes[1:])
+    store = RecipeStore(PerkProfile(100))
+    store.update(ingrs)
+    assert ([r.ingr_ids for r in store.recipes(True)] ==
+            [r.ingr_ids for r in recipes])
+
+
+def test_combinations():
+    ingrs = _testIngredients()
+    rf = RecipeFactory(list(ingrs))
+    names = [set(ef.EffectID for ef in ingr.effects) for ingr in rf.ingrs]
+    for calc2, calc3 in [(True, True), (True, False), (False, True)]:
+        combs = list(rf.combinationsIter(calc2, calc3))
+        assert rf.countCombinations(calc2, calc3) == len(combs)
+        # Every combination with a pair sharing an effect, in order
+        expected = [comb for size in (3, 2) if (calc2, calc3)[size - 2]
+                    for comb in itertools.combinations(range(len(ingrs)),
+                                                       size)
+                    if any(names[a] & names[b] for a, b in
+                           itertools.combinations(comb, 2))]
+        assert sorted(combs) == sorted(expected)
+        valid = [comb for comb in expected
+                 if Recipe(100, ingrs=[rf.ingrs[i] for i in comb]).valid]
+        assert len(rf.calcRecipes(100, calc2=calc2, calc3=calc3)) == len(valid)
+    try:
+        list(rf.combinationsIter(False, False))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("calc2 or calc3 must be required")
+
+
+def test_calcRecipesParallel():
+    from multiprocessing import get_context
+    rf = RecipeFactory(_testIngredients())
+    perks = [0xc07cb, 0x58215, 0x58216, 0x58217, 0x5821d]
+    recipes = [recipe for recipe in rf.calcRecipesIter(50, 10, perks)
+               if recipe.valid]
+    recipes_mp = rf.calcRecipesParallel(50, 10, perks, workers=2,
+                                        mp_context=get_context("spawn"))
+    assert ([(r.Name, r.Value, r.ingr_ids, r.magnitudes) for r in recipes] ==
+            [(r.Name, r.Value, r.ingr_ids, r.magnitudes) for r in recipes_mp])
+
+
+def test_calcRecipesNumpy():
+    rf = RecipeFactory(_testIngredients())
+    for perks in ([], [0xc07cb, 0x58215, 0x58216, 0x58217, 0x5821d]):
+        for calc2, calc3 in [(True, True), (True, False), (False, True)]:
+            recipes = rf.calcRecipes(50, 10, perks, calc2, calc3)
+            recipes_np = rf.calcRecipes(50, 10, perks, calc2, calc3,
+                                        engine="numpy")
+            assert ([(r.Name, r.Value, r.ingr_ids, r.effect_ids,
+                      r.magnitudes, r.durations) for r in recipes] ==
+                    [(r.Name, r.Value, r.ingr_ids, r.effect_ids,
+                      r.magnitudes, r.durations) for r in recipes_np])
+
+
+def test_topRecipes():
+    perks = [0xc07cb, 0x58215, 0x58216, 0x58217, 0x5821d]
+    # X lists Paralysis twice, so the Y, Z, X triple beats every pair
+    for spec in (None, [("X", 5, [2, 2]), ("Y", 3, [0]), ("Z", 2, [0, 4]),
+                        ("W", 1, [3, 4])]):
+        rf = RecipeFactory(_testIngredients(spec))
+        for calc2, calc3 in [(True, True), (True, False), (False, True)]:
+            for args in ((50, 10, []), (100, 0, perks)):
+                recipes = rf.calcRecipes(*args, calc2=calc2, calc3=calc3)
+                for k in range(1, len(recipes) + 1):
+                    top = rf.topRecipes(k, *args, calc2=calc2, calc3=calc3)
+                    assert ([(r.Value, r.ingr_ids) for r in top] ==
+                            [(r.Value, r.ingr_ids) for r in recipes[:k]])
+
+
+def test_planBrewing():
+    def recipe(ids, value):
+        return Recipe.fromEvaluation(ids, "Potion", value, (), (), ())
+    ab, ac, bd = recipe((1, 2), 10.), recipe((1, 3), 7.), recipe((2, 4), 7.)
+    abc = recipe((1, 2, 3), 12.)
+    # Brewing the most valuable recipe first isn't best
+    plan, total = planBrewing([ab, ac, bd], {1: 1, 2: 1, 3: 1, 4: 1})
+    assert total == 14.
+    assert [(r.ingr_ids, count) for r, count in plan] == [((1, 3), 1),
+                                                          ((2, 4), 1)]
+    # Only recipes with ingredients in stock, as many times as they allow
+    plan, total = planBrewing([abc, ab, ac, bd], {1: 3, 2: 2, 3: 0})
+    assert total == 20.
+    assert [(r.ingr_ids, count) for r, count in plan] == [((1, 2), 2)]
+    plan, total = planBrewing([ab, ac], {})
+    assert plan == [] and total == 0
+
+
 def test_alchemy():
     import skyrimdata
     skyrimdata.loadData()
@@ -205,6 +1309,12 @@ def test_alchemy():
     assert [e.Value for e in pp.effects] == [233.0, 70.0, 45.0]
     assert len(pp.effects) == 3
     assert [e.Description for e in pp.effects]
+    try:
+        pp.Value = 0.
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("Recipe should be immutable")
 
     # Potion of Restore Magicka
     perks60 = [0xc07cb, 0x58215, 0x58216, 0x58217, 0x5821d]
@@ -277,3 +1387,67 @@ def test_alchemy():
                                             'Poison of Damage Magicka Regen',
                                             'Potion of Fortify One-handed',
                                             'Potion of Restore Health']
+    rf.calcRecipes(100, perks=perks60, unique=True)
+    assert [r.Value for r in rf.recipes] == [568, 253, 57]
+
+    # Vectorized engine
+    rf = RecipeFactory([bh, imp, ss, bear, blue, rock, frost, fire, salt])
+    for perks in ([], perks60):
+        recipes = rf.calcRecipes(100, perks=perks)
+        recipes_np = rf.calcRecipes(100, perks=perks, engine="numpy")
+        assert ([(r.Name, r.Value, r.ingrs) for r in recipes] ==
+                [(r.Name, r.Value, r.ingrs) for r in recipes_np])
+        assert ([[e.Description for e in r.effects] for r in recipes] ==
+                [[e.Description for e in r.effects] for r in recipes_np])
+
+    # Top recipes
+    for perks in ([], perks60):
+        recipes = rf.calcRecipes(100, perks=perks)
+        top = rf.topRecipes(5, 100, perks=perks)
+        assert ([(r.Name, r.Value, r.ingrs) for r in recipes[:5]] ==
+                [(r.Name, r.Value, r.ingrs) for r in top])
+
+    # Parameter sweep
+    ids, values = rf.valueCurves([49, 100], [0, 20], [[], perks60])
+    for s, skill in enumerate([49, 100]):
+        for f, fortify in enumerate([0, 20]):
+            for p, perks in enumerate([[], perks60]):
+                recipes = [r for r in rf.calcRecipesIter(skill, fortify, perks)
+                           if r.valid]
+                assert [r.ingr_ids for r in recipes] == ids
+                assert [r.Value for r in recipes] == values[:, s, f, p].tolist()
+
+    # Process pool
+    recipes = rf.calcRecipes(100, perks=perks60)
+    recipes_mp = rf.calcRecipes(100, perks=perks60, workers=2)
+    assert ([(r.Name, r.Value, r.ingrs) for r in recipes] ==
+            [(r.Name, r.Value, r.ingrs) for r in recipes_mp])
+
+    # Incremental recomputation
+    store = RecipeStore(PerkProfile(100, perks=perks60))
+    store.update([bh, imp, ss, bear, blue])
+    store.update([bh, imp, ss, bear, blue, rock, frost, fire, salt],
+                 PerkProfile(100))
+    assert ([(r.Name, r.Value, r.ingrs) for r in store.recipes()] ==
+            [(r.Name, r.Value, r.ingrs) for r in rf.calcRecipes(100)])
+    store.setProfile(PerkProfile(100, perks=perks60))
+    store.removeIngredient(salt.id)
+    rf.ingrs = [bh, imp, ss, bear, blue, rock, frost, fire]
+    assert ([(r.Name, r.Value, r.ingrs) for r in store.recipes(True)] ==
+            [(r.Name, r.Value, r.ingrs)
+             for r in rf.calcRecipes(100, perks=perks60, unique=True)])
+    rf.ingrs = [bh, imp, ss, bear, blue, rock, frost, fire, salt]
+    rf.calcRecipes(100, perks=perks60)
+
+    # Batch brewing
+    stock = {bear.id: 2, blue.id: 1, rock.id: 5}
+    plan, total = planBrewing(rf.recipes, stock)
+    used = {}
+    for recipe, count in plan:
+        for id_ in recipe.ingr_ids:
+            used[id_] = used.get(id_, 0) + count
+    assert all(count <= stock[id_] for id_, count in used.items())
+    assert total == sum(recipe.Value * count for recipe, count in plan)
+    brewable = [r for r in rf.recipes
+                if all(id_ in stock for id_ in r.ingr_ids)]
+    assert total >= max(r.Value for r in brewable)
@@ -18,6 +18,7 @@ import os.path as osp
 import subprocess
 import ctypes
 import logging
+import multiprocessing
 from importlib import reload
 reload(logging)  # Needed inside Spyder IDE
 import argparse
@@ -29,7 +30,6 @@ try:
 except ImportError:
     from Queue import PriorityQueue  # PY2
 import operator
-import math
 
 #%% Setup PyQt's v2 APIs. Must be done before importing PyQt or PySide
 import rthook
@@ -89,6 +89,8 @@ class SavegameThread(QtCore.QThread):
         queue.put((1, 'load'))
         self.queue = queue
         self.running = True
+        self.store = None
+        self.cache = savegame.SavegameCache()
         super(SavegameThread, self).__init__(*args, **kwargs)
         # Setup Jinja templating
         self.env = Environment(loader=FileSystemLoader(frozen('data')))
@@ -124,7 +126,8 @@ class SavegameThread(QtCore.QThread):
             elif job == 'savegame':
                 filename = data[0]
                 self.newJob.emit("savegame", os.stat(filename).st_size)
-                sg = savegame.Savegame(filename, load_now=False)
+                sg = savegame.Savegame(filename, load_now=False,
+                                       profile="summary", cache=self.cache)
                 for status in sg.loadGame():
                     self.jobStatus.emit(status)
                 sg.populate_ids()
@@ -136,13 +139,6 @@ class SavegameThread(QtCore.QThread):
                 self.newJob.emit("", 0)
             elif job == 'combs':
                 alch_skill, fortify_alch, perks, model_ingrs = data[0]
-                n = len(model_ingrs) + 1
-                if n > 3:
-                    f = math.factorial
-                    ncombs = f(n)//(f(3)*f(n-3))
-                else:
-                    ncombs = 1
-                self.newJob.emit("combs", ncombs)
                 ingr_formids = set()
                 for formid, name, count, value, weight, hformid in model_ingrs:
                     ingr_formids.add(formid)
@@ -150,10 +146,15 @@ class SavegameThread(QtCore.QThread):
                 for ingr_id, ingr in skyrimdata.db['INGR'].items():
                     if ingr_id in ingr_formids:
                         ingrs.append(ingr)
-                rf = alchemy.RecipeFactory(ingrs)
-                recipe_iter = rf.calcRecipesIter(alch_skill, fortify_alch, perks)
-                for i, recipe in enumerate(recipe_iter):
-                    self.recipeItem.emit(i, recipe)
+                profile = alchemy.PerkProfile(alch_skill, fortify_alch, perks)
+                if self.store is None:
+                    self.store = alchemy.RecipeStore(profile)
+                # Only new ingredients or a new profile are recalculated
+                self.store.update(ingrs, profile)
+                recipes = self.store.recipes(unique=True)
+                self.newJob.emit("combs", len(recipes))
+                for i, recipe in enumerate(recipes):
+                    self.recipeItem.emit(i + 1, recipe)
 #                    if i > 100:
 #                        break
                 self.newJob.emit("", 0)
@@ -351,22 +352,34 @@ class WndMain(QtWidgets.QMainWindow):
         self.thread.inventoryItem.connect(self.on_thread_inventoryItem)
         self.thread.recipeItem.connect(self.on_thread_recipeItem)
         self.thread.start()
-        savegames = savegame.getSaveGames()
-        # Sort by last modified time first
-        savegames = sorted(savegames,
-                           key=lambda f: osp.getmtime(f),
-                           reverse=True)
+        # Only savegame headers are read (and cached), newest first
+        savegames = savegame.SaveCatalog().scan()
         if len(savegames):
             self.comboSavegames.addItem(self.tr("Select savegame"))
 #            self.comboSavegames.setCurrentIndex(0)
-        for f in savegames:
-            self.comboSavegames.addItem(osp.basename(f), f)
+        for entry in savegames:
+            self.addSavegameItem(entry)
 #            self.open_savegame(savegames[0])
         # Setup Jinja templating
         self.env = Environment(loader=FileSystemLoader(frozen('data')))
         self.recipes = []
 
 
+    def addSavegameItem(self, entry):
+        """Add a savegame to the picker, showing its header metadata."""
+        text = self.tr("{name}, level {level} - {location} ({date})").format(
+            name=entry['playerName'], level=entry['playerLevel'],
+            location=entry['playerLocation'], date=entry['gameDate'])
+        width, height = entry['thumbWidth'], entry['thumbHeight']
+        image = QtGui.QImage(entry['thumbData'], width, height, 3*width,
+                             QtGui.QImage.Format_RGB888)
+        icon = QtGui.QIcon(QtGui.QPixmap.fromImage(image))
+        self.comboSavegames.addItem(icon, text, entry['filename'])
+        self.comboSavegames.setItemData(self.comboSavegames.count() - 1,
+                                        osp.basename(entry['filename']),
+                                        QtCore.Qt.ToolTipRole)
+        self.comboSavegames.setIconSize(QtCore.QSize(width, height))
+
     def initUI(self):
         ui_file = frozen(osp.join('data', 'wndmain.ui'))
         uic.loadUi(ui_file, self)
@@ -455,10 +468,6 @@ class WndMain(QtWidgets.QMainWindow):
     def on_thread_inventoryItem(self, count, formid):
         model = self.tableIngr.model()
         model.addItem(formid, count)
-        n = model.rowCount() + 1
-        if n > 3:
-            f = math.factorial
-            self.progressComb.setMaximum(f(n)//(f(3)*f(n-3)))
 
     @QtCore.Slot(QtCore.QItemSelection, QtCore.QItemSelection)
     def on_tableIngr_selectionChanged(self, selected, deselected):
@@ -507,6 +516,8 @@ class WndMain(QtWidgets.QMainWindow):
 #%% Main execution
 # Runs when executing script directly (not importing).
 if __name__ == '__main__':
+    ### Worker processes of the frozen executable must not start the GUI
+    multiprocessing.freeze_support()
     ### Properly register window icon
     myappid = u'br.com.dapaixao.skyalchemy.1.0'
     ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
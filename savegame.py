@@ -13,15 +13,92 @@ from __future__ import unicode_literals
 
 import struct
 from collections import OrderedDict
-from io import BytesIO
+import mmap
+import pickle
+import zlib
+import time
 import os
 import os.path as osp
 import ctypes
 import ctypes.wintypes
 
 #%% unpack and data
-from skyrimtypes import unpack, RefID
+from skyrimtypes import RefID, Cursor, wstring_from, filetime
 import skyrimdata
+from skyrimstructs import (ChangeForm, ChangeFormHeader, decompressIter,
+                           read_globalData, read_CreatedObjects)
+
+_uint32 = struct.Struct("<I")
+_header_start = struct.Struct("<II")  # version, saveNumber
+_header_end = struct.Struct("<HffQII")  # playerSex to shotHeight
+_plugin_info = struct.Struct("<BI")  # formVersion, pluginInfoSize
+_location_table = struct.Struct("<10I")
+
+_player_refid = 0x14  # Player ACHR change form
+
+#%% Decode profiles
+# Sections each Savegame profile decodes. 'gdata' holds the global data
+# types to decode (None for all), the others are on/off. Sections that are
+# off are skipped over.
+profiles = {
+    "full": {
+        "screenshot": True,
+        "gdata": None,
+        "changeforms": True,  # Index all change forms up front
+        "formid": True,
+        "worldspaces": True,
+    },
+    # Enough for the ingredients in the player inventory: Created Objects
+    # and the formID array name potions and RefIDs.
+    "ingredients": {
+        "screenshot": False,
+        "gdata": {4},
+        "changeforms": False,
+        "formid": True,
+        "worldspaces": False,
+    },
+    # What the GUI shows: the ingredients, header and screenshot. Savegames
+    # loaded with it may come from a SavegameCache.
+    "summary": {
+        "screenshot": True,
+        "gdata": {4},
+        "changeforms": False,
+        "formid": True,
+        "worldspaces": False,
+    },
+}
+
+
+#%%
+def parseHeader(buf, d):
+    """Decode the file header of a savegame buffer into `d`.
+
+    Only the magic, header size and header fields are read. Returns the
+    offset of the screenshot data, which follows the header.
+    """
+    d['magic'] = bytes(buf[:13])
+    if d['magic'] != b'TESV_SAVEGAME':
+        raise AssertionError("Incorrect magic in file header")
+    d['headerSize'] = _uint32.unpack_from(buf, 13)[0]
+    # Header
+    pos = 17
+    d['version'], d['saveNumber'] = _header_start.unpack_from(buf, pos)
+    if not 7 <= d['version'] <= 9:
+        raise AssertionError("Only versions 7 to 9 are supported")
+    d['playerName'], pos = wstring_from(buf, pos + _header_start.size)
+    d['playerLevel'] = _uint32.unpack_from(buf, pos)[0]
+    d['playerLocation'], pos = wstring_from(buf, pos + 4)
+    d['gameDate'], pos = wstring_from(buf, pos)
+    d['playerRaceEditorId'], pos = wstring_from(buf, pos)
+    (sex, curExp, lvlUpExp, ftime, shotWidth,
+     shotHeight) = _header_end.unpack_from(buf, pos)
+    d['playerSex'] = {0: "male", 1: "female"}[sex]
+    d['playerCurExp'] = curExp
+    d['playerLvlUpExp'] = lvlUpExp
+    d['filetime'] = filetime(ftime)
+    d['shotWidth'] = shotWidth
+    d['shotHeight'] = shotHeight
+    return 17 + d['headerSize']
 
 
 #%%
@@ -29,125 +106,231 @@ class Savegame(object):
     """This class loads a The Elder Scrolls V: Skyrim savegame file and parses
     useful information.
     """
-    def __init__(self, filename, load_now=True):
+    def __init__(self, filename, load_now=True, profile="full", cache=None):
         self.filename = filename
+        self.profile = profile
+        self.cache = cache
         if load_now:
             for i in self.loadGame():
                 pass
 
     def loadGame(self):
-        filename = self.filename
-        #%%
+        """Parse the savegame, yielding the file position as it goes.
+
+        The file is memory-mapped and decoded in place, so sections aren't
+        copied around. The file is closed once parsing ends. Only the
+        sections of the Savegame's profile (see `profiles`) are decoded.
+
+        With a SavegameCache, a savegame it already holds is loaded from it
+        instead when it covers the profile, and new ones are added to it.
+        """
+        profile = profiles[self.profile]
+        if self.cache is not None and self.cache.covers(profile):
+            size = self.cache.load(self)
+            if size is not None:
+                yield size
+                return
         d = OrderedDict()  # Data storage
-        f = open(filename, 'rb')  # TODO: replace
-        f.seek(0)
-        if True:
-#        with open(filename, 'rb') as f:
-            # File
-            d['magic'] = f.read(13)
-            yield f.tell()
-            if d['magic'] != b'TESV_SAVEGAME':
-                raise AssertionError("Incorrect magic in file header")
-            d['headerSize'] = unpack("uint32", f)
-            # Header
-            header = BytesIO(f.read(d['headerSize']))
-            d['version'] = unpack("uint32", header)
-            if not 7 <= d['version'] <= 9:
-                raise AssertionError("Only versions 7 to 9 are supported")
-            d['saveNumber'] = unpack("uint32", header)
-            d['playerName'] = unpack("wstring", header)
-            d['playerLevel'] = unpack("uint32", header)
-            d['playerLocation'] = unpack("wstring", header)
-            d['gameDate'] = unpack("wstring", header)
-            d['playerRaceEditorId'] = unpack("wstring", header)
-            d['playerSex'] = {0: "male", 1: "female"}[unpack("uint16", header)]
-            d['playerCurExp'] = unpack("float32", header)
-            d['playerLvlUpExp'] = unpack("float32", header)
-            d['filetime'] = unpack("filetime", header)
-            d['shotWidth'] = unpack("uint32", header)
-            d['shotHeight'] = unpack("uint32", header)
-            yield f.tell()
-            # Back to file
-            d['screenshotData'] = f.read(3*d['shotWidth']*d['shotHeight'])
+        with open(self.filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with memoryview(mm) as buf:
+                for pos in self._parse(mm, buf, d, profile):
+                    yield pos
+                self.d = d
+                if self.cache is not None and profile["formid"]:
+                    self.cache.store(self, buf)
+        finally:
+            mm.close()
+
+    def _parsePrefix(self, buf, d, profile):
+        """Decode the header, screenshot and plugin list.
+
+        Returns the offset of the file location table, which follows them.
+        """
+        pos = parseHeader(buf, d)
+        shot_size = 3*d['shotWidth']*d['shotHeight']
+        if profile["screenshot"]:
+            d['screenshotData'] = bytes(buf[pos:pos+shot_size])
             from PIL import Image
             d['screenshotImage'] = Image.frombytes("RGB",
                                          (d['shotWidth'], d['shotHeight']),
                                          d['screenshotData'])
-            yield f.tell()
-            d['formVersion'] = unpack("uint8", f)
-            d['pluginInfoSize'] = unpack("uint32", f)
-            # Plugin
-            plugin = BytesIO(f.read(d['pluginInfoSize']))
-            d['pluginCount'] = unpack("uint8", plugin)
-            d['plugins'] = [unpack("wstring", plugin)
-                            for i in range(d['pluginCount'])]
-            yield f.tell()
-            # File Location Table
-            formIDArrayCountOffset = unpack("uint32", f)
-            unknownTable3Offset = unpack("uint32", f)
-            globalDataTable1Offset = unpack("uint32", f)
-            globalDataTable2Offset = unpack("uint32", f)
-            changeFormsOffset = unpack("uint32", f)
-            globalDataTable3Offset = unpack("uint32", f)
-            globalDataTable1Count = unpack("uint32", f)
-            globalDataTable2Count = unpack("uint32", f)
-            globalDataTable3Count = unpack("uint32", f)
-            changeFormCount = unpack("uint32", f)
-            f.read(4*15)  # unused
-            yield f.tell()
-            # Global Data 1
-            f.seek(globalDataTable1Offset)
-            gdata1 = []
-            for i in range(globalDataTable1Count):
-                gdata1.append(unpack("globalData", f))
-                yield f.tell()
-            # Global Data 2
-            f.seek(globalDataTable2Offset)
-            gdata2 = []
-            for i in range(globalDataTable2Count):
-                gdata2.append(unpack("globalData", f))
-                yield f.tell()
-            # changeForms
-            f.seek(changeFormsOffset)
-            d_changeforms = []
+        pos += shot_size
+        d['formVersion'], d['pluginInfoSize'] = _plugin_info.unpack_from(
+            buf, pos)
+        pos += _plugin_info.size
+        # Plugin
+        plugin_end = pos + d['pluginInfoSize']
+        d['pluginCount'] = buf[pos]
+        pos += 1
+        d['plugins'] = []
+        for i in range(d['pluginCount']):
+            name, pos = wstring_from(buf, pos)
+            d['plugins'].append(name)
+        return plugin_end
+
+    def _readGlobalData(self, cursor, count, types, table):
+        """Decode a global data table into `table`, yielding positions.
+
+        Where the Created Objects data lies is kept for SavegameCache.
+        """
+        for i in range(count):
+            start = cursor.pos
+            entry = read_globalData(cursor, types)
+            if entry is not None:
+                table.append(entry)
+                if entry[0] == 4:  # Created Objects
+                    self._sections['created'] = (start + 8, cursor.pos)
+            yield cursor.pos
+
+    def _parse(self, mm, buf, d, profile):
+        self._sections = {}  # Spans of the sections SavegameCache keeps
+        pos = self._parsePrefix(buf, d, profile)
+        self._sections['prefix'] = (0, pos)
+        yield pos
+        # File Location Table
+        (formIDArrayCountOffset, unknownTable3Offset, globalDataTable1Offset,
+         globalDataTable2Offset, changeFormsOffset, globalDataTable3Offset,
+         globalDataTable1Count, globalDataTable2Count, globalDataTable3Count,
+         changeFormCount) = _location_table.unpack_from(buf, pos)
+        pos += _location_table.size + 4*15  # unused
+        yield pos
+        gdata_types = profile["gdata"]
+        # Global Data 1
+        cursor = Cursor(mm, globalDataTable1Offset)
+        gdata = []
+        for pos in self._readGlobalData(cursor, globalDataTable1Count,
+                                        gdata_types, gdata):
+            yield pos
+        # Global Data 2
+        cursor.seek(globalDataTable2Offset)
+        for pos in self._readGlobalData(cursor, globalDataTable2Count,
+                                        gdata_types, gdata):
+            yield pos
+        # changeForms, only indexed here (see changeForms)
+        self._changeFormTable = (changeFormsOffset, changeFormCount)
+        self.changeFormIndex = None
+        self._changeforms = {}
+        if profile["changeforms"]:
+            for pos in self._indexChangeForms(buf, d):
+                yield pos
+        else:  # Just find the player
+            pos = changeFormsOffset
             for i in range(changeFormCount):
-                d_changeforms.append(unpack("ChangeForm", f))
-                yield f.tell()
-            d['changeforms'] = d_changeforms
-            # Global Data 3
-            yield f.tell()
-            f.seek(globalDataTable3Offset)
-            gdata3 = []
-            for i in range(globalDataTable3Count):
-                gdata3.append(unpack("globalData", f))
-                yield f.tell()
-            d['gdata'] = {v[1]:v[2] for v in (gdata1 + gdata2 + gdata3)}
-            # formID
-            f.seek(formIDArrayCountOffset)
-            formIDArrayCount = unpack("uint32", f)
-            d['formid'] = struct.Struct('{}I'.format(formIDArrayCount)).unpack(
-                f.read(formIDArrayCount*4))
-            yield f.tell()
-            # Visited Worldspace
-            visitedWorldspaceArrayCount = unpack("uint32", f)
-            d['visitedWorldspaceArray'] = struct.Struct('{}I'.format(
-                visitedWorldspaceArrayCount)).unpack(f.read(
-                visitedWorldspaceArrayCount*4))
-            yield f.tell()
-            # unknownTable3
-            f.seek(unknownTable3Offset)
-            ukt3count = unpack("uint32", f)
-            assert(len(f.read()) == ukt3count)
-            # EOF
-            assert(f.read() == b"")
-            yield f.tell()
-            # Inventory
-            for cf in d['changeforms']:
-                if cf.type == 1 and cf.formid.value == 0x14:
+                header = ChangeFormHeader(buf, pos)
+                if (header.formid.value == _player_refid and
+                        header.type == 1):
+                    self._player = header
                     break
-            d['inventory'] = cf.d['inventory']
+                pos = header.end
+            else:
+                raise AssertionError("Player change form not found")
+        # Global Data 3
+        yield pos
+        cursor.seek(globalDataTable3Offset)
+        for pos in self._readGlobalData(cursor, globalDataTable3Count,
+                                        gdata_types, gdata):
+            yield pos
+        d['gdata'] = {v[1]:v[2] for v in gdata}
+        # formID
+        if profile["formid"]:
+            pos = formIDArrayCountOffset
+            formIDArrayCount = _uint32.unpack_from(buf, pos)[0]
+            d['formid'] = struct.unpack_from(
+                '<{}I'.format(formIDArrayCount), buf, pos + 4)
+            self._sections['formid'] = (pos + 4, pos + 4 + formIDArrayCount*4)
+            pos += 4 + formIDArrayCount*4
+            yield pos
+        # Visited Worldspace
+        if profile["worldspaces"]:
+            pos = formIDArrayCountOffset
+            pos += 4 + _uint32.unpack_from(buf, pos)[0]*4
+            visitedWorldspaceArrayCount = _uint32.unpack_from(buf, pos)[0]
+            d['visitedWorldspaceArray'] = struct.unpack_from(
+                '<{}I'.format(visitedWorldspaceArrayCount), buf, pos + 4)
+            pos += 4 + visitedWorldspaceArrayCount*4
+            yield pos
+            # unknownTable3
+            ukt3count = _uint32.unpack_from(buf, unknownTable3Offset)[0]
+            # The table runs to EOF
+            assert(len(buf) - unknownTable3Offset - 4 == ukt3count)
+        yield len(buf)
+        # Inventory
+        if self.changeFormIndex is None:
+            cf = ChangeForm.fromHeader(self._player, buf,
+                                       self._inflate(self._player, buf))
+            self._changeforms[self._player.offset] = cf
+        else:
+            cf = self.changeForms(_player_refid, cf_type=1, buf=buf)[0]
+        self.playerForm = cf
+        d['inventory'] = cf.d.get('inventory', [])
+
+    def _indexChangeForms(self, buf, d):
+        """Index the change form headers, yielding positions as it goes."""
+        pos, count = self._changeFormTable
+        d_changeforms = []
+        index = {}
+        for i in range(count):
+            header = ChangeFormHeader(buf, pos)
+            d_changeforms.append(header)
+            index.setdefault(header.formid.value, []).append(header)
+            pos = header.end
+            yield pos
+        d['changeforms'] = d_changeforms
+        self.changeFormIndex = index
 
-            self.d = d
+    @staticmethod
+    def _inflate(header, buf):
+        """Decompressed data of a change form, or None if uncompressed."""
+        if not header.length2:
+            return None
+        return next(decompressIter([(buf[header.offset:header.end],
+                                     header.length2)]))
+
+    def changeForms(self, formid=None, cf_type=None, buf=None):
+        """Decode the change forms of a form ID (RefID value).
+
+        Change forms are decompressed and decoded on first use, reading
+        them from the savegame file unless a buffer with it is given. With
+        no `formid`, all change forms are decoded. `cf_type` keeps only
+        change forms of that type (e.g. 1 for ACHR).
+        """
+        if self.changeFormIndex is None:  # Not indexed by the profile
+            missing = True
+        else:
+            if formid is None:
+                headers = self.d['changeforms']
+            else:
+                headers = self.changeFormIndex.get(formid, [])
+            headers = [header for header in headers
+                       if cf_type is None or header.type == cf_type]
+            missing = [header for header in headers
+                       if header.offset not in self._changeforms]
+        if missing and buf is None:
+            with open(self.filename, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                with memoryview(mm) as buf:
+                    return self.changeForms(formid, cf_type, buf)
+            finally:
+                mm.close()
+        if self.changeFormIndex is None:
+            for pos in self._indexChangeForms(buf, self.d):
+                pass
+            return self.changeForms(formid, cf_type, buf)
+        # Decompress in a thread pool while decoding in order
+        results = decompressIter((buf[header.offset:header.end],
+                                  header.length2)
+                                 for header in missing if header.length2)
+        try:
+            for header in missing:
+                data = next(results) if header.length2 else None
+                self._changeforms[header.offset] = ChangeForm.fromHeader(
+                    header, buf, data)
+        finally:
+            results.close()  # Release its views of buf
+        return [self._changeforms[header.offset] for header in headers]
 
     def populate_ids(self):
         for k, created in self.d['gdata']['Created Objects'].items():
@@ -167,28 +350,415 @@ class Savegame(object):
                 yield (inv_item.itemcount, inv_item.item.value)
 
 
+#%% Parsed savegame cache
+_cache_magic = b'SKYALCH_SAVE'
+_cache_version = 2
+# magic, version, file size, mtime (ns), content hash, change forms offset
+# and count
+_cache_header = struct.Struct("<12sHQqIII")
+_cache_player = struct.Struct("<3sIBB")  # RefID, changeFlags, type, version
+_cache_sample = 64 * 1024  # Bytes hashed at each end of the savegame
+
+
+class SavegameCache(object):
+    """Keeps the parsed essentials of savegames on disk.
+
+    For each savegame a file in `cache_dir` holds its path and the sections
+    needed for its ingredients: the header, screenshot and plugin list, the
+    Created Objects data, the formID array and the player's (decompressed)
+    change form. They are stored in their savegame binary encoding, each
+    prefixed by its length, so loading is just a read and a decode of those
+    few sections. Entries are valid while the savegame's size, mtime and
+    hash of its first and last bytes are unchanged. Only profiles needing
+    no more than that are loaded from the cache (see covers).
+
+    Entries of savegames that no longer exist are removed, as are the least
+    recently used ones once the cache grows past `max_size` bytes.
+
+    Savegames loaded from the cache have no change form index up front;
+    Savegame.changeForms reads it from the savegame file when needed.
+    """
+    def __init__(self, cache_dir=osp.join("data", "savecache"),
+                 max_size=128 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._entries = None  # {cache file: (last use, size)}, see prune
+
+    def path(self, filename):
+        key = zlib.crc32(osp.abspath(filename).encode('utf8'))
+        return osp.join(self.cache_dir, "{:08x}.sav".format(key))
+
+    @staticmethod
+    def covers(profile):
+        """Whether the cache holds every section a profile decodes."""
+        return (profile["gdata"] is not None and profile["gdata"] <= {4} and
+                not profile["changeforms"] and not profile["worldspaces"])
+
+    @staticmethod
+    def fingerprint(filename):
+        """(size, mtime in ns, hash) of a savegame."""
+        with open(filename, 'rb') as f:
+            st = os.fstat(f.fileno())
+            crc = zlib.crc32(f.read(_cache_sample))
+            if st.st_size > _cache_sample:
+                f.seek(max(_cache_sample, st.st_size - _cache_sample))
+                crc = zlib.crc32(f.read(), crc)
+        return st.st_size, st.st_mtime_ns, crc
+
+    @staticmethod
+    def _sections(buf, count):
+        """The first `count` length-prefixed sections of an entry."""
+        sections = []
+        pos = _cache_header.size
+        for i in range(count):
+            if pos + 4 > len(buf):
+                return None
+            length = _uint32.unpack_from(buf, pos)[0]
+            pos += 4
+            sections.append(buf[pos:pos+length])
+            pos += length
+        return sections if pos <= len(buf) else None
+
+    def load(self, sg):
+        """Fill in a Savegame from the cache.
+
+        Returns the savegame size, or None on a miss.
+        """
+        path = self.path(sg.filename)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        if len(data) < _cache_header.size:
+            return None
+        (magic, version, size, mtime, crc, changeFormsOffset,
+         changeFormCount) = _cache_header.unpack_from(data)
+        if magic != _cache_magic or version != _cache_version:
+            return None
+        sections = self._sections(memoryview(data), 5)
+        if (sections is None or bytes(sections[0]).decode('utf8') !=
+                osp.abspath(sg.filename) or
+                (size, mtime, crc) != self.fingerprint(sg.filename)):
+            return None
+        filename, prefix, created, formid, player = sections
+        d = OrderedDict()
+        sg._parsePrefix(prefix, d, profiles[sg.profile])
+        d['gdata'] = {}
+        if len(created):
+            d['gdata']["Created Objects"] = read_CreatedObjects(
+                Cursor(bytes(created)))
+        d['formid'] = struct.unpack('<{}I'.format(len(formid)//4), formid)
+        refid, changeFlags, type_, version = _cache_player.unpack_from(player)
+        cf = ChangeForm.fromData(RefID.unpack_from(refid, 0), changeFlags,
+                                 type_, version, player[_cache_player.size:])
+        d['inventory'] = cf.d.get('inventory', [])
+        sg._changeFormTable = (changeFormsOffset, changeFormCount)
+        sg.changeFormIndex = None
+        sg._changeforms = {}
+        sg.playerForm = cf
+        sg.d = d
+        try:  # Its mtime is its last use
+            os.utime(path, None)
+        except OSError:
+            pass
+        if self._entries is not None:
+            self._entries[path] = (time.time(), len(data))
+        return size
+
+    def store(self, sg, buf):
+        """Add a Savegame just parsed from `buf` to the cache."""
+        cf = sg.playerForm
+        refid = struct.pack(">I", (cf.formid.type_ << 22) |
+                            cf.formid.value)[1:]
+        sections = [osp.abspath(sg.filename).encode('utf8')]
+        sections.extend(buf[start:end] for start, end in
+                        (sg._sections['prefix'],
+                         sg._sections.get('created', (0, 0)),
+                         sg._sections['formid']))
+        sections.append(_cache_player.pack(refid, cf.changeFlags, cf.type,
+                                           cf.version) + cf.data)
+        size, mtime, crc = self.fingerprint(sg.filename)
+        chunks = [_cache_header.pack(_cache_magic, _cache_version, size,
+                                     mtime, crc, *sg._changeFormTable)]
+        for section in sections:
+            chunks.append(_uint32.pack(len(section)))
+            chunks.append(bytes(section))
+        data = b''.join(chunks)
+        if not osp.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        path = self.path(sg.filename)
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        if self._entries is None:
+            self.prune()
+        else:
+            self._entries[path] = (time.time(), len(data))
+            self._evict()
+
+    def prune(self):
+        """Remove the entries of savegames that are gone or changed format,
+        then the least recently used ones until the cache fits max_size.
+        """
+        entries = {}
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            names = []
+        for name in names:
+            if not name.endswith(".sav"):
+                continue
+            path = osp.join(self.cache_dir, name)
+            try:
+                with open(path, 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    data = f.read(_cache_header.size + 4)
+                    if len(data) == _cache_header.size + 4:
+                        data += f.read(_uint32.unpack_from(data, -4)[0])
+            except (IOError, OSError):
+                continue
+            sections = None
+            if (len(data) >= _cache_header.size and
+                    _cache_header.unpack_from(data)[:2] == (_cache_magic,
+                                                           _cache_version)):
+                sections = self._sections(data, 1)
+            if sections is None or not osp.exists(sections[0].decode('utf8')):
+                self._remove(path)
+            else:
+                entries[path] = (st.st_mtime, st.st_size)
+        self._entries = entries
+        self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries past max_size."""
+        total = sum(size for last_use, size in self._entries.values())
+        for path in sorted(self._entries, key=self._entries.get):
+            if total <= self.max_size:
+                break
+            total -= self._entries.pop(path)[1]
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:  # e.g. already removed by another process
+            pass
+
+
 #%%
-def getSaveGames():
-    """Get list of savegame files"""
-    dll = ctypes.windll.shell32
-    buf = ctypes.create_unicode_buffer(ctypes.wintypes.MAX_PATH + 1)
+def getSaveDir():
+    """Find the savegame directory.
+
+    On Windows it's under the user's documents folder. Elsewhere, the
+    Wine and Steam Proton prefixes where Skyrim usually runs are tried.
+    """
+    candidates = []
     try:
+        dll = ctypes.windll.shell32
+        buf = ctypes.create_unicode_buffer(ctypes.wintypes.MAX_PATH + 1)
         if dll.SHGetSpecialFolderPathW(None, buf, 0x0005, False):
-            savedir = osp.join(buf.value, "My Games", "Skyrim", "Saves")
-            if not osp.exists(savedir) or not osp.isdir(savedir):
-                raise RuntimeError("Could not find savegame directory.")
-        else:
-            raise RuntimeError("Could not find savegame directory.")
-    except:
-        raise RuntimeError("Could not find savegame directory.")
+            candidates.append(buf.value)
+    except AttributeError:  # Not on Windows
+        home = osp.expanduser("~")
+        user = os.environ.get("USER", "")
+        for steam in (osp.join(home, ".steam", "steam"),
+                      osp.join(home, ".local", "share", "Steam")):
+            candidates.append(osp.join(steam, "steamapps", "compatdata",
+                                       "72850", "pfx", "drive_c", "users",
+                                       "steamuser", "My Documents"))
+            candidates.append(osp.join(steam, "steamapps", "compatdata",
+                                       "72850", "pfx", "drive_c", "users",
+                                       "steamuser", "Documents"))
+        wine = os.environ.get("WINEPREFIX", osp.join(home, ".wine"))
+        candidates.append(osp.join(wine, "drive_c", "users", user,
+                                   "My Documents"))
+        candidates.append(osp.join(wine, "drive_c", "users", user,
+                                   "Documents"))
+    for documents in candidates:
+        savedir = osp.join(documents, "My Games", "Skyrim", "Saves")
+        if osp.isdir(savedir):
+            return savedir
+    raise RuntimeError("Could not find savegame directory.")
+
+
+def getSaveGames(savedir=None):
+    """Get list of savegame files"""
+    if savedir is None:
+        savedir = getSaveDir()
     savegames = [osp.join(savedir, f) for f in os.listdir(savedir) if f.endswith(".ess")]
     return savegames
 
 
-#%%
+#%% Savegame catalog
+class SaveCatalog(object):
+    """Header metadata of savegames, cached on disk.
+
+    Only the file header and screenshot of each savegame are read, and the
+    results are kept in `cache_file` keyed by path, size and modification
+    time, so unchanged files aren't opened again. Each entry is a dict with
+    the header fields, 'filename', 'size', 'mtime' and a downscaled
+    screenshot as 'thumbWidth', 'thumbHeight' and RGB 'thumbData'.
+    """
+    thumb_size = (96, 96)
+
+    def __init__(self, cache_file=osp.join("data", "savegames.pkl")):
+        self.cache_file = cache_file
+        self.entries = {}
+        if cache_file is not None and osp.exists(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    self.entries = pickle.load(f)
+            except Exception:  # Stale or corrupt cache, just rescan
+                self.entries = {}
+
+    def scan(self, savedir=None):
+        """Return the entries of the savegames in `savedir`, newest first.
+
+        The cache is updated (and saved) if any file was added, removed or
+        modified since the last scan.
+        """
+        if savedir is None:
+            savedir = getSaveDir()
+        savedir = osp.normpath(savedir)
+        entries = []
+        changed = False
+        seen = set()
+        for dir_entry in os.scandir(savedir):
+            if not dir_entry.name.endswith(".ess"):
+                continue
+            path = dir_entry.path
+            st = dir_entry.stat()
+            seen.add(path)
+            entry = self.entries.get(path)
+            if (entry is None or entry['size'] != st.st_size or
+                    entry['mtime'] != st.st_mtime_ns):
+                try:
+                    entry = readSaveInfo(path, self.thumb_size)
+                except (AssertionError, KeyError, struct.error, OSError):
+                    continue  # Not a savegame we can read
+                entry['size'] = st.st_size
+                entry['mtime'] = st.st_mtime_ns
+                self.entries[path] = entry
+                changed = True
+            entries.append(entry)
+        for path in [path for path in self.entries
+                     if osp.dirname(path) == savedir and path not in seen]:
+            del self.entries[path]
+            changed = True
+        if changed:
+            self.save()
+        entries.sort(key=lambda entry: entry['mtime'], reverse=True)
+        return entries
+
+    def save(self):
+        if self.cache_file is None:
+            return
+        with open(self.cache_file, 'wb') as f:
+            pickle.dump(self.entries, f, pickle.HIGHEST_PROTOCOL)
+
+
+def readSaveInfo(filename, thumb_size=SaveCatalog.thumb_size):
+    """Read only the header and screenshot of a savegame.
+
+    Returns a dict with the header fields, 'filename' and the screenshot
+    downscaled to fit `thumb_size` (see SaveCatalog).
+    """
+    d = {'filename': filename}
+    with open(filename, 'rb') as f:
+        buf = f.read(17)
+        buf += f.read(_uint32.unpack_from(buf, 13)[0])
+        parseHeader(buf, d)
+        width, height = d['shotWidth'], d['shotHeight']
+        shot = f.read(3*width*height)
+    if len(shot) != 3*width*height:
+        raise AssertionError("Truncated screenshot data")
+    from PIL import Image
+    image = Image.frombytes("RGB", (width, height), shot)
+    image.thumbnail(thumb_size)
+    d['thumbWidth'], d['thumbHeight'] = image.size
+    d['thumbData'] = image.tobytes()
+    return d
+
+
+#%% Tests
+def _testSavegame(filename, items=((1, 3), (2, 5))):
+    """Write a minimal savegame, for tests without game files.
+
+    The player carries `items`, (formID array index, count) pairs.
+    """
+    def wstring(text):
+        return struct.pack("<H", len(text)) + text.encode('utf8')
+    header = (_header_start.pack(9, 1) + wstring("Prisoner") +
+              _uint32.pack(3) + wstring("Helgen") + wstring("4E 201") +
+              wstring("NordRace") + _header_end.pack(0, 0., 100., 0, 1, 1))
+    plugins = b"\x01" + wstring("Skyrim.esm")
+    prefix = (b'TESV_SAVEGAME' + _uint32.pack(len(header)) + header +
+              b"\x00" * 3 + _plugin_info.pack(74, len(plugins)) + plugins)
+    gdata2 = struct.pack("<II", 4, 4) + b"\x00" * 4  # No Created Objects
+    inventory = b"\x00" * 8 + bytes(bytearray([len(items) << 2]))
+    for index, count in items:
+        inventory += struct.pack(">I", index)[1:] + struct.pack("<i", count)
+        inventory += b"\x00"  # No extra data
+    player = (struct.pack(">I", _player_refid)[1:] +
+              struct.pack("<IBBBB", 0x20, 1, 1, len(inventory), 0) + inventory)
+    formids = (0x64b3f, 0x3ad61)
+    offset = len(prefix) + _location_table.size + 4*15
+    gdata2_offset = offset
+    changeforms_offset = gdata2_offset + len(gdata2)
+    formid_offset = changeforms_offset + len(player)
+    unknown3_offset = formid_offset + 4 + 4*len(formids) + 4
+    table = _location_table.pack(formid_offset, unknown3_offset, offset,
+                                 gdata2_offset, changeforms_offset,
+                                 formid_offset, 0, 1, 0, 1)
+    with open(filename, 'wb') as f:
+        f.write(prefix + table + b"\x00" * 4*15 + gdata2 + player)
+        f.write(struct.pack("<I{}I".format(len(formids)), len(formids),
+                            *formids))
+        f.write(_uint32.pack(0) + _uint32.pack(0))  # Worldspaces, table 3
+    return filename
+
+
+def test_cache():
+    import tempfile
+    import shutil
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = _testSavegame(osp.join(tmp, "test.ess"))
+        cache = SavegameCache(osp.join(tmp, "cache"))
+        sg = Savegame(filename, profile="summary", cache=cache)
+        # The second time the savegame isn't parsed
+        cached = Savegame(filename, load_now=False, profile="summary",
+                          cache=cache)
+
+        def parse(*args):
+            raise AssertionError("Savegame parsed despite the cache")
+        cached._parse = parse
+        for pos in cached.loadGame():
+            pass
+        for key in ('playerName', 'plugins', 'screenshotData', 'formid'):
+            assert cached.d[key] == sg.d[key]
+        for d in (sg.d, cached.d):
+            assert ([(inv_item.item.value, inv_item.itemcount)
+                     for inv_item in d['inventory']] == [(1, 3), (2, 5)])
+        # The full profile needs what the cache doesn't keep
+        assert not cache.covers(profiles["full"])
+    finally:
+        shutil.rmtree(tmp)
+
+
 def test_savegame():
     #%%
     savegames = getSaveGames()
     for filename in savegames:
         sg = Savegame(filename)
         sg.populate_createdid()
+
+
+def test_catalog():
+    #%%
+    catalog = SaveCatalog(cache_file=None)
+    for entry in catalog.scan():
+        print(entry['playerName'], entry['playerLevel'],
+              entry['playerLocation'], entry['gameDate'])
@@ -16,7 +16,12 @@ import os
 import os.path as osp
 import re
 import pickle
-from io import BytesIO
+import json
+import mmap
+import multiprocessing
+import struct
+import warnings
+from array import array
 
 
 #%% Data records to store
@@ -26,13 +31,96 @@ db_types = ['MGEF', 'INGR', 'ALCH', 'ARMO', 'ENCH', 'MISC', 'SCRL', 'BOOK',
 # Only load once
 #if 'db' not in locals():
 #    print("db not in locals!")
-db = {k: {} for k in db_types}
+class GameData(dict):
+    """The game database: {record type: {formid: record}}.
+
+    Types in a loaded snapshot (see loadSnapshot) are decoded the first
+    time they are used, so e.g. the recipe view never builds WEAP, BOOK or
+    ARMO records.
+    """
+    def __init__(self, types):
+        super(GameData, self).__init__((k, {}) for k in types)
+        self.pending = {}  # {record type: Snapshot}
+
+    def __getitem__(self, key):
+        if key in self.pending:
+            self.pending.pop(key).decode(key, dict.__getitem__(self, key))
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self.pending.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.pending.pop(key, None)
+        dict.__delitem__(self, key)
+
+    def __iter__(self):  # Also makes dict(db) go through __getitem__
+        return dict.__iter__(self)
+
+    def __eq__(self, other):
+        self._decodeAll()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        self._decodeAll()
+        return dict.__repr__(self)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        self._decodeAll()
+        return dict.popitem(self)
+
+    def clear(self):
+        self.pending.clear()
+        dict.clear(self)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def copy(self):
+        return dict(self.items())
+
+    def _decodeAll(self):
+        for key in list(self.pending):
+            self[key]
+
+    def values(self):
+        self._decodeAll()
+        return super(GameData, self).values()
+
+    def items(self):
+        self._decodeAll()
+        return super(GameData, self).items()
+
+    def __reduce__(self):
+        return (GameData, ((),), None, None, iter(self.items()))
+
+db = GameData(db_types)
 #else:
 #    print("db in locals!")
 #if 'lstrings' not in locals():
-lstrings = {}
-
-from skyrimtypes import unpack, RefID
+from skyrimtypes import RefID, lstrings, saveStringTable
 
 #%% Fast printing to stdout
 if "print" not in locals():
@@ -59,65 +147,451 @@ def getSkyrimFolder(folders):
 
 
 #%% Strings
-def strdir(f):
-    return (unpack("uint32", f), unpack("uint32", f))
+_strings_header = struct.Struct("<II")  # count, dataSize
 
-def extract_strings(filename):
+
+def extract_strings(filename, raw=False, progress=None):
     """Extract strings from string table
 
+    The directory is read as one array of (id, offset) pairs and strings
+    are sliced out of the data block. With `raw`, strings are left as
+    undecoded bytes (e.g. for saveStringTable). `progress`, if given, is
+    called as progress(done, total) about every percent.
+
     Based on data from:
     http://en.m.uesp.net/wiki/Tes5Mod:String_Table_File_Format
     """
-    f = open(filename, 'rb')
-    str_count = unpack("uint32", f)
-    dataSize = unpack("uint32", f)
+    with open(filename, 'rb') as f:
+        str_count, dataSize = _strings_header.unpack(
+            f.read(_strings_header.size))
+        strings_dir = array("I")
+        strings_dir.frombytes(f.read(8*str_count))
+        data = f.read(dataSize)
+    if sys.byteorder == "big":
+        strings_dir.byteswap()
+    ids = strings_dir[0::2]
+    offsets = strings_dir[1::2]
+    # .dlstrings and .ilstrings strings have a length before them
+    skip = 0 if filename.lower().endswith(".strings") else 4
+    find = data.find
+    step = max(1, str_count // 100)
     strings = {}
-    strings_dir = []
-    for i in range(str_count):
-        print("Reading directory: {}/{} = {:0.2f}".format(
-            i, str_count, i/str_count*100))
-        strings_dir.append(strdir(f))
-
-    data = BytesIO(f.read(dataSize))
-    f.close()
-    if filename.lower().endswith(".strings"):
-        for i, (id_, offset) in enumerate(strings_dir):
-            print("Reading string: {}/{} = {:0.2f}".format(
-                i, str_count, i/str_count*100))
-            data.seek(offset)
-            strings[id_] = unpack("zstring", data)
-#    else:  # .dlstrings, .ilstrings
-#        for i, (id_, offset) in enumerate(strings_dir):
-#            print("Reading string: {}/{} = {:0.2f}".format(
-#                i, str_count, i/str_count*100))
-#            data.seek(offset + 4)  # ignore lenght
-#            strings[id_] = unpack("zstring", data)
+    for i, (id_, offset) in enumerate(zip(ids, offsets)):
+        start = offset + skip
+        end = find(b'\x00', start)
+        if end < 0:
+            end = len(data)
+        strings[id_] = data[start:end]
+        if progress is not None and i % step == 0:
+            progress(i, str_count)
+    if progress is not None:
+        progress(str_count, str_count)
+    if not raw:
+        for id_, string in strings.items():
+            try:
+                strings[id_] = string.decode('utf8')
+            except UnicodeDecodeError:
+                strings[id_] = string.decode('cp1252')
     return strings
 
 
-__lstrings_file = osp.join("data", "lstrings.pkl")
-__data_file = osp.join("data", "data.pkl")
+def _printProgress(label):
+    """A progress callback printing percentages."""
+    def progress(done, total):
+        print("{}: {}/{} = {:0.2f}".format(label, done, total,
+                                            done/max(total, 1)*100))
+    return progress
+
+
+#%% Snapshot
+# Game data is stored column by column, one section per record type: a
+# JSON directory of the columns followed by their binary arrays, which are
+# memory-mapped and only decoded when a record type is first used.
+_snapshot_magic = b"SKYALCHDB"
+_snapshot_version = 1
+_snapshot_header = struct.Struct("<9sHI")  # magic, version, directory size
+
+
+def _columnKind(values):
+    """Storage kind of a column, from the values of its records."""
+    kinds = set()
+    for value in values:
+        if isinstance(value, bool) or value is None:
+            return "json"
+        elif isinstance(value, int):
+            kinds.add("int")
+        elif isinstance(value, float):
+            kinds.add("float")
+        elif isinstance(value, str):
+            kinds.add("str")
+        elif isinstance(value, list):
+            items = set(_columnKind([item]) for item in value)
+            if len(items) > 1:
+                return "json"
+            kinds.add(items.pop() + "s" if items else "list")
+        elif type(value).__name__ == "Effect":
+            kinds.add("effect")
+        else:
+            return "json"
+    if kinds <= {"int", "float"} and "float" in kinds:
+        return "float"
+    if kinds == {"int"} or kinds == {"str"}:
+        return kinds.pop()
+    kinds.discard("list")  # Empty lists fit any list kind
+    if len(kinds) == 1 and kinds <= {"ints", "floats", "strs", "effects"}:
+        return kinds.pop()
+    if not kinds:
+        return "ints"
+    return "json"
+
+
+def _hasBytes(value):
+    """Whether a value holds raw bytes, which snapshots don't store."""
+    if isinstance(value, (bytes, bytearray)):
+        return True
+    if isinstance(value, list):
+        return any(_hasBytes(item) for item in value)
+    if hasattr(value, "__dict__"):
+        return any(_hasBytes(item) for item in vars(value).values())
+    return False
+
+
+def _jsonValue(value):
+    if isinstance(value, list):
+        return [_jsonValue(item) for item in value]
+    if hasattr(value, "__dict__"):
+        return {"__class__": type(value).__name__,
+                "attrs": {k: _jsonValue(v) for k, v in vars(value).items()}}
+    return value
+
+
+def _fromJson(value):
+    if isinstance(value, list):
+        return [_fromJson(item) for item in value]
+    if isinstance(value, dict):
+        from skyrimtypes import _types
+        obj = _types[value["__class__"]].__new__(_types[value["__class__"]])
+        obj.__dict__.update((k, _fromJson(v))
+                            for k, v in value["attrs"].items())
+        return obj
+    return value
+
+
+class _SnapshotWriter(object):
+    def __init__(self):
+        self.blobs = []
+        self.size = 0
+
+    def add(self, data):
+        """Add a blob, returning its (offset, length)."""
+        data = bytes(data)
+        entry = (self.size, len(data))
+        padding = -len(data) % 8  # Keep arrays aligned
+        self.blobs.append(data + b"\0" * padding)
+        self.size += len(data) + padding
+        return entry
+
+    def strings(self, strings):
+        encoded = [string.encode("utf8") for string in strings]
+        offsets = array("q", [0])
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        return [self.add(offsets), self.add(b"".join(encoded))]
+
+    def ragged(self, lists):
+        offsets = array("q", [0])
+        for items in lists:
+            offsets.append(offsets[-1] + len(items))
+        return self.add(offsets)
+
+    def column(self, kind, values):
+        """Blobs of a column."""
+        if kind == "int":
+            return [self.add(array("q", values))]
+        elif kind == "float":
+            return [self.add(array("d", values))]
+        elif kind == "str":
+            return self.strings(values)
+        elif kind == "json":
+            return self.strings([json.dumps(_jsonValue(value))
+                                 for value in values])
+        items = [item for value in values for item in value]
+        if kind == "effects":
+            return [self.ragged(values),
+                    self.add(array("q", [ef.EffectID for ef in items])),
+                    self.add(array("d", [ef.Magnitude for ef in items])),
+                    self.add(array("q", [ef.AreaOfEffect for ef in items])),
+                    self.add(array("q", [ef.Duration for ef in items]))]
+        return [self.ragged(values)] + self.column(kind[:-1], items)
+
+
+def saveSnapshot(db, filename):
+    """Save the game database as a columnar snapshot.
+
+    Raw subrecords (`fields`, in records pickled by older versions) and
+    other bytes-valued attributes are left out.
+    """
+    writer = _SnapshotWriter()
+    sections = {}
+    for type_, records in sorted(db.items()):
+        records = list(records.values())
+        names = []
+        for record in records:
+            for name in vars(record):
+                if name not in names and name != "fields":
+                    names.append(name)
+        columns = []
+        for name in names:
+            missing = [name not in vars(record) for record in records]
+            values = [getattr(record, name) for record in records
+                      if name in vars(record)]
+            if any(_hasBytes(value) for value in values):
+                continue
+            kind = _columnKind(values)
+            column = {"name": name, "kind": kind,
+                      "blobs": writer.column(kind, values)}
+            if any(missing):
+                column["missing"] = writer.add(bytearray(missing))
+            columns.append(column)
+        sections[type_] = {"count": len(records), "columns": columns}
+    directory = json.dumps({"sections": sections}).encode("utf8")
+    directory += b" " * (-(_snapshot_header.size + len(directory)) % 8)
+    with open(filename, "wb") as f:
+        f.write(_snapshot_header.pack(_snapshot_magic, _snapshot_version,
+                                      len(directory)))
+        f.write(directory)
+        for blob in writer.blobs:
+            f.write(blob)
+
+
+class Snapshot(object):
+    """A memory-mapped snapshot, decoding record types on request."""
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size = _snapshot_header.unpack_from(self.mm)
+        if magic != _snapshot_magic or version != _snapshot_version:
+            raise ValueError("Unsupported game data snapshot")
+        start = _snapshot_header.size
+        self.sections = json.loads(self.mm[start:start+size].decode("utf8"))[
+            "sections"]
+        self.buf = memoryview(self.mm)[start+size:]
+
+    def _blob(self, blob, fmt=None):
+        offset, length = blob
+        view = self.buf[offset:offset+length]
+        return view if fmt is None else view.cast(fmt)
+
+    def _strings(self, blobs):
+        offsets = self._blob(blobs[0], "q")
+        data = bytes(self._blob(blobs[1]))
+        return [data[offsets[i]:offsets[i+1]].decode("utf8")
+                for i in range(len(offsets) - 1)]
+
+    def _column(self, kind, blobs):
+        """Values of a column, as a list."""
+        if kind == "int":
+            return self._blob(blobs[0], "q").tolist()
+        elif kind == "float":
+            return self._blob(blobs[0], "d").tolist()
+        elif kind == "str":
+            return self._strings(blobs)
+        elif kind == "json":
+            return [_fromJson(json.loads(value))
+                    for value in self._strings(blobs)]
+        offsets = self._blob(blobs[0], "q").tolist()
+        if kind == "effects":
+            from skyrimstructs import Effect
+            columns = [self._blob(blob, fmt).tolist() for blob, fmt in
+                       zip(blobs[1:], ("q", "d", "q", "q"))]
+            items = []
+            for id_, mag, area, dur in zip(*columns):
+                effect = Effect(id_)
+                effect.Magnitude = mag
+                effect.AreaOfEffect = area
+                effect.Duration = dur
+                items.append(effect)
+        else:
+            items = self._column(kind[:-1], blobs[1:])
+        return [items[offsets[i]:offsets[i+1]]
+                for i in range(len(offsets) - 1)]
+
+    def ids(self, type_):
+        """Form IDs of a record type, without decoding its records."""
+        for column in self.sections[type_]["columns"]:
+            if column["name"] == "id":
+                return self._blob(column["blobs"][0], "q")
+        return memoryview(array("q"))  # No records, so no columns
+
+    def decode(self, type_, records):
+        """Decode the records of a type into the `records` dict."""
+        from skyrimstructs import _read_record_types
+        section = self.sections[type_]
+        count = section["count"]
+        attrs = [{} for i in range(count)]
+        for column in section["columns"]:
+            name = column["name"]
+            values = iter(self._column(column["kind"], column["blobs"]))
+            if "missing" in column:
+                missing = self._blob(column["missing"])
+                for i in range(count):
+                    if not missing[i]:
+                        attrs[i][name] = next(values)
+            else:
+                for d, value in zip(attrs, values):
+                    d[name] = value
+        for d in attrs:
+            cls = _read_record_types[d["type"]]
+            record = cls.__new__(cls)
+            record.__dict__ = d
+            records[d["id"]] = record
+
+
+def loadSnapshot(filename):
+    """Load a snapshot into `db`. Record types are decoded on first use."""
+    snapshot = Snapshot(filename)
+    for type_ in snapshot.sections:
+        dict.setdefault(db, type_, {}).clear()  # Keep the same dicts
+        db.pending[type_] = snapshot
+    RefID.defaultid = DefaultIDs(snapshot, RefID.defaultid)
+
+
+class DefaultIDs(dict):
+    """RefID.defaultid for a snapshot: {formid: record}, decoding only the
+    record type a form ID belongs to when it's looked up.
+    """
+    def __init__(self, snapshot, initial=()):
+        super(DefaultIDs, self).__init__(initial)
+        self.types = {}
+        for type_ in snapshot.sections:
+            self.types.update(dict.fromkeys(snapshot.ids(type_).tolist(),
+                                            type_))
+
+    def __contains__(self, formid):
+        return dict.__contains__(self, formid) or formid in self.types
+
+    def __missing__(self, formid):
+        return db[self.types[formid]][formid]
+
+    def get(self, formid, default=None):
+        try:
+            return self[formid]
+        except KeyError:
+            return default
+
+
+__lstrings_file = lstrings.filename
+__data_file = osp.join("data", "data.snap")
+__data_pickle = osp.join("data", "data.pkl")  # Before snapshots
 def loadData():
     """load data from data files.
 
     This should be only done once per program, for performance.
     """
+    if (not osp.exists(__data_file)) and osp.exists(__data_pickle):
+        with open(__data_pickle, 'rb') as f:  # Convert it once
+            saveSnapshot(pickle.load(f), __data_file)
+    lstrings.open()  # Converts an older lstrings.pkl
     if (not osp.exists(__data_file)) or (not osp.exists(__lstrings_file)):
         extractData()
-        
-    with open(__data_file, 'rb') as f:
-        db.update(pickle.load(f))
-    with open(__lstrings_file, 'rb') as f:
-        lstrings.update(pickle.load(f))
-
-    for k, v in db.items():
-        RefID.defaultid.update(v)
+
+    loadSnapshot(__data_file)
 #    db['unKYWD'] = {}
 #    for k, v in db['KYWD'].items():
 #        db['unKYWD'][v.EditorID] = k
 
 
-def extractData():
+#%% Plugins
+# Plugins that always load first, in this order
+_load_order = ["skyrim.esm", "update.esm", "dawnguard.esm",
+               "hearthfires.esm", "dragonborn.esm"]
+
+
+def sortPlugins(filenames):
+    """Sort plugin files in load order.
+
+    The game and official DLC come first, the others after them by name.
+    """
+    def key(filename):
+        name = osp.basename(filename).lower()
+        if name in _load_order:
+            return (_load_order.index(name), "")
+        return (len(_load_order), name)
+    return sorted(filenames, key=key)
+
+
+def extractPlugins(filenames, workers=None):
+    """Read the game data of plugins into db using a process pool.
+
+    Each wanted top level group (see skyrimstructs.indexGroups) is read by
+    a worker, largest first. Form IDs are remapped from each plugin's
+    masters list to load order, as the game does, and the partial databases
+    are merged in load order, so records in later plugins override the ones
+    they replace in earlier plugins.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from skyrimstructs import (indexGroups, readMasters, _read_record_types,
+                               db)
+    filenames = sortPlugins(filenames)
+    load_order = [osp.basename(fn).lower() for fn in filenames]
+    tasks = []  # (filename, label, offset, size, form ID map) in load order
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            masters = [name.lower() for name in readMasters(f)]
+            formid_map = formIDMap(masters, osp.basename(filename).lower(),
+                                   load_order)
+            tasks.extend((filename, label, offset, size, formid_map)
+                         for label, offset, size in indexGroups(f)
+                         if label in _read_record_types)
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {}
+        for i in sorted(range(len(tasks)), key=lambda i: -tasks[i][3]):
+            filename, label, offset, size, formid_map = tasks[i]
+            futures[i] = pool.submit(_extractGroup, filename, offset,
+                                     formid_map)
+        for i, (filename, label, offset, size, formid_map) in enumerate(tasks):
+            partial = futures.pop(i).result()
+            print("{} {}: {}".format(osp.basename(filename), label,
+                                     sum(len(v) for v in partial.values())))
+            sys.stdout.flush()
+            for type_, records in partial.items():
+                db[type_].update(records)
+
+
+def formIDMap(masters, plugin, load_order):
+    """{master index: load order index} for the form IDs of a plugin.
+
+    `masters` are the plugin's masters and `load_order` all plugins, by
+    name. Masters missing from the load order are left unmapped.
+    """
+    formid_map = {}
+    for i, name in enumerate(masters + [plugin]):
+        if name in load_order:
+            formid_map[i] = load_order.index(name)
+        else:
+            warnings.warn("{} is missing master {}".format(plugin, name))
+    return formid_map
+
+
+def _extractGroup(filename, offset, formid_map=None):
+    """Read a top level group of a plugin, in a worker process.
+
+    Returns the records it added to db as {type: {formid: record}}.
+    """
+    from skyrimstructs import Group, setFormIDMap, db
+    for type_ in db_types:
+        db[type_].clear()  # Start afresh for every group
+    setFormIDMap(formid_map)
+    try:
+        with open(filename, 'rb') as f:
+            f.seek(offset + 4)  # After "GRUP"
+            Group(f)
+    finally:
+        setFormIDMap(None)
+    return {type_: dict(records) for type_, records in db.items() if records}
+
+
+def extractData(workers=None):
     folders = getSteamLibraryFolders()
     folder = getSkyrimFolder(folders)
     if folder is None:
@@ -127,59 +601,126 @@ def extractData():
     # Only supports English localization
     if osp.exists(__lstrings_file):
         print("lstrings file already exists. Skipping extraction. Delete {} "
-              "to extract again.")
-        if len(lstrings) == 0:
-            with open(__lstrings_file, 'rb') as f:
-                lstrings.update(pickle.load(f))
-
+              "to extract again.".format(__lstrings_file))
     else:
+        strings = {}
         strings_files = os.listdir(osp.join(folder, 'Data', 'Strings'))
         for strings_filename in strings_files:
             print("Extracting lstrings from {}".format(osp.basename(
                   strings_filename)))
-            lstrings.update(extract_strings(osp.join(folder, "Data", "Strings",
-                                                     strings_filename)))
-        with open(__lstrings_file, 'wb') as f:
-            pickle.dump(lstrings, f)
+            strings.update(extract_strings(
+                osp.join(folder, "Data", "Strings", strings_filename),
+                raw=True, progress=_printProgress("Reading strings")))
+        saveStringTable(strings, __lstrings_file)
+        lstrings.reload()
 
     #%% ***.esm data files
 
     data_filenames = [osp.join(folder, "Data", fn)
                       for fn in os.listdir(osp.join(folder, "Data"))
                       if fn.endswith('.esm')]
-    from skyrimstructs import Group, Record, db
+    from skyrimstructs import db
     if osp.exists(__data_file):
         print("Data is already extracted. Skipping.")
     else:
-        for data_filename in data_filenames:
-            print("Extracting data from {}".format(osp.basename(data_filename)))
-            f = open(data_filename, 'rb')
-            f.seek(0)
-            records = []
-            i = 0
-            while True:
-                type_ = f.read(4).decode("cp1252")
-            #    if i == 10:
-            #        break
-                if type_ == "":  # EOF
-                    break
-                if type_ == "GRUP":
-                    record = Group(f)
-                else:
-                    record = Record(f, type_)
-                records.append(record)
-                print(i, record, f.tell())
-                sys.stdout.flush()
-                i += 1
-
-            f.close()
+        print("Extracting data from {}".format(", ".join(
+            osp.basename(fn) for fn in sortPlugins(data_filenames))))
+        extractPlugins(data_filenames, workers)
 
         #%% Save data
-        with open(__data_file, 'wb') as f:
-            pickle.dump(db, f)
+        saveSnapshot(db, __data_file)
+
+#%% Tests
+def test_snapshot():
+    import shutil
+    import tempfile
+    from skyrimstructs import INGR, Effect, Field
+    from skyrimtypes import Cursor
+
+    def ingr(id_, name, effects):
+        record = INGR.__new__(INGR)
+        record.__dict__.update(type="INGR", id=id_, flags=0, revision=7,
+                               version=40, EditorID=name, FullName=name,
+                               Value=id_ % 7, Weight=0.25, effects=[])
+        for effect_id, magnitude in effects:
+            effect = Effect(effect_id)
+            effect.Magnitude = magnitude
+            effect.Duration = 60
+            record.effects.append(effect)
+        return record
+
+    records = {1: ingr(1, "Foo", [(0x3eb15, 2.5), (0x3eb16, 1)]),
+               2: ingr(2, "Bar", []),
+               3: ingr(3, "Baz", [(0x3eb15, 0.5)])}
+    records[3].flags = 0x40000
+    del records[2].Weight
+    # Records pickled by older versions kept their raw subrecords
+    old = pickle.loads(pickle.dumps({"INGR": records, "MGEF": {}}))
+    for record in old["INGR"].values():
+        record.fields = [Field(Cursor(b"EDID\x04\x00Foo\x00"))]
+        record.raw = b"\x01\x02"
+
+    def attrs(record):
+        d = dict(vars(record))
+        d["effects"] = [vars(effect) for effect in d["effects"]]
+        return d
+
+    folder = tempfile.mkdtemp()
+    try:
+        for i, data in enumerate([{"INGR": records}, old]):
+            filename = osp.join(folder, "data{}.snap".format(i))
+            saveSnapshot(data, filename)
+            snapshot = Snapshot(filename)
+            assert snapshot.ids("INGR").tolist() == [1, 2, 3]
+            gdata = GameData(["INGR"])
+            gdata.pending["INGR"] = snapshot
+            assert dict(gdata)["INGR"] is gdata["INGR"]
+            assert ({k: attrs(v) for k, v in gdata["INGR"].items()} ==
+                    {k: attrs(v) for k, v in records.items()})
+            assert not hasattr(gdata["INGR"][2], "Weight")
+
+        # Pending types are decoded whichever way db is read
+        filename = osp.join(folder, "data0.snap")
+        for read in (lambda d: dict(d)["INGR"], lambda d: d.copy()["INGR"],
+                     lambda d: dict(d.items())["INGR"],
+                     lambda d: d.setdefault("INGR", {}),
+                     lambda d: d.pop("INGR"), lambda d: d.popitem()[1],
+                     lambda d: list(d.values())[0]):
+            gdata = GameData(["INGR"])
+            gdata.pending["INGR"] = Snapshot(filename)
+            assert sorted(read(gdata)) == [1, 2, 3]
+        gdata = GameData(["INGR"])
+        gdata.pending["INGR"] = Snapshot(filename)
+        saveSnapshot(gdata, osp.join(folder, "again.snap"))
+        assert Snapshot(osp.join(folder, "again.snap")).sections == \
+            Snapshot(filename).sections
+        gdata = GameData(["INGR"])
+        gdata.pending["INGR"] = Snapshot(filename)
+        assert sorted(pickle.loads(pickle.dumps(gdata))["INGR"]) == [1, 2, 3]
+
+        # A record type without records has no id column
+        filename = osp.join(folder, "empty.snap")
+        saveSnapshot({"INGR": records, "MGEF": {}}, filename)
+        assert Snapshot(filename).ids("MGEF").tolist() == []
+        saved = {k: dict(dict.__getitem__(db, k)) for k in ("INGR", "MGEF")}
+        pending, defaultid = dict(db.pending), RefID.defaultid
+        try:
+            loadSnapshot(filename)
+            assert db["MGEF"] == {}
+            assert sorted(db["INGR"]) == [1, 2, 3]
+            assert RefID.defaultid[3].FullName == "Baz"
+        finally:
+            for k, values in saved.items():
+                dict.__getitem__(db, k).clear()
+                dict.__getitem__(db, k).update(values)
+            db.pending, RefID.defaultid = pending, defaultid
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
 
 #%% Execution
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     extractData()
         #%%
 #        print(records[27].records[0])
@@ -11,13 +11,17 @@ See LICENSE for details.
 
 from __future__ import unicode_literals, division
 
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+import os
+import struct
 import zlib
 import ctypes
 import math
+import warnings
 
 #%% unpack and data
-from skyrimtypes import _types, unpack, RefID
+from skyrimtypes import (_types, unpack, RefID, Cursor, zstring_from,
+                         get_lstring)
 from skyrimdata import db
 
 #%%
@@ -204,14 +208,64 @@ _gdata_type_names = {
     1005: ("Main", lambda f: "Not implemented"),
 }
 
-def read_globalData(f):
+def read_globalData(f, types=None):
+    """Decode a global data entry as (type, type name, value).
+
+    If `types` is given and the entry's type isn't in it, it is skipped
+    without decoding and None is returned.
+    """
     type_ = unpack("uint32", f)
     type_name, type_decoder = _gdata_type_names[type_]
     length = unpack("uint32", f)
-    return (type_, type_name, type_decoder(BytesIO(f.read(length))))
+    start = f.tell()
+    if types is not None and type_ not in types:
+        f.seek(start + length)
+        return None
+    # Decode in place and skip to the end, instead of copying the table
+    value = type_decoder(f)
+    f.seek(start + length)
+    return (type_, type_name, value)
 _types["globalData"] = read_globalData
 
 
+#%% Parallel decompression
+_decompress_pool = None
+_decompress_batch = 256 * 1024  # Compressed bytes per pool task
+
+
+def _decompressBatch(batch):
+    return [zlib.decompress(data, 0, size) for data, size in batch]
+
+
+def decompressIter(payloads):
+    """Decompress (data, size) zlib payloads, yielding results in order.
+
+    zlib releases the GIL, so payloads are decompressed in a thread pool
+    in batches, all submitted up front. Decoding the first results can
+    then overlap with decompressing the rest.
+    """
+    global _decompress_pool
+    batches = [[]]
+    batch_size = 0
+    for data, size in payloads:
+        if batch_size >= _decompress_batch:
+            batches.append([])
+            batch_size = 0
+        batches[-1].append((data, size))
+        batch_size += len(data)
+    if len(batches) == 1:
+        for result in _decompressBatch(batches[0]):
+            yield result
+        return
+    if _decompress_pool is None:
+        _decompress_pool = ThreadPoolExecutor(os.cpu_count() or 1)
+    futures = [_decompress_pool.submit(_decompressBatch, batch)
+               for batch in batches]
+    for future in futures:
+        for result in future.result():
+            yield result
+
+
 #%% Change Form
 _ChangeForm_flags = {
     "CHANGE_FORM_FLAGS": 0x01,
@@ -249,6 +303,38 @@ extra_data_flags = (_ChangeForm_flags['CHANGE_REFR_EXTRA_OWNERSHIP'] |
                     _ChangeForm_flags['CHANGE_OBJECT_EXTRA_ITEM_DATA'])
 
 
+_ChangeForm_header = struct.Struct("<IBB")  # changeFlags, type, version
+_ChangeForm_lengths = {0: struct.Struct("<BB"), 1: struct.Struct("<HH"),
+                       2: struct.Struct("<II")}
+
+
+class ChangeFormHeader(object):
+    """Header of a change form and where its data is in the savegame.
+
+    Reading only headers is enough to index a savegame; the data is
+    decompressed and decoded later by `ChangeForm.fromHeader`.
+    """
+    __slots__ = ('formid', 'changeFlags', 'type', 'version', 'offset',
+                 'length1', 'length2')
+
+    def __init__(self, buf, offset):
+        self.formid = RefID.unpack_from(buf, offset)
+        self.changeFlags, type_, self.version = \
+            _ChangeForm_header.unpack_from(buf, offset + 3)
+        self.type = type_ & 0b111111
+        lengths = _ChangeForm_lengths[type_ >> 6]
+        self.length1, self.length2 = lengths.unpack_from(buf, offset + 9)
+        self.offset = offset + 9 + lengths.size
+
+    @property
+    def end(self):
+        """Offset of the next change form."""
+        return self.offset + self.length1
+
+    def __repr__(self):
+        return "ChangeFormHeader<{}>".format(self.formid)
+
+
 class ChangeForm(object):
     def __init__(self, f):
         self.formid = unpack("RefID", f)
@@ -259,14 +345,56 @@ class ChangeForm(object):
         self.version = unpack("uint8", f)
         length1 = unpack(sizeFlag, f)
         length2 = unpack(sizeFlag, f)
-        data = f.read(length1)
+        self._decode(f.read(length1), length2)
+
+    @classmethod
+    def fromHeader(cls, header, buf, data=None):
+        """Decode the change form indexed by a ChangeFormHeader.
+
+        `data` is the already decompressed data, if it was compressed.
+        """
+        if data is None:
+            return cls.fromData(header.formid, header.changeFlags,
+                                header.type, header.version,
+                                buf[header.offset:header.end], header.length2)
+        return cls.fromData(header.formid, header.changeFlags, header.type,
+                            header.version, data)
+
+    @classmethod
+    def fromData(cls, formid, changeFlags, type_, version, data, length2=0):
+        """Decode a change form from its header fields and data.
+
+        `length2` is the decompressed size if `data` is compressed.
+        """
+        cf = cls.__new__(cls)
+        cf.formid = formid
+        cf.changeFlags = changeFlags
+        cf.type = type_
+        cf.version = version
+        cf._decode(data, length2)
+        return cf
+
+    def _decode(self, data, length2):
         if length2 != 0:
             data = zlib.decompress(data, 0, length2)
+        else:
+            data = bytes(data)
         self.data = data
         self.d = {}
-
+        try:
+            self._decodeData(data)
+        except (struct.error, NotImplementedError, IndexError,
+                UnicodeDecodeError) as e:
+            # Layouts aren't all known, but the form's length is: skip the
+            # rest of it, keeping whatever was decoded (e.g. the items before
+            # a broken one), so one form doesn't fail the whole savegame.
+            self.d['error'] = "{}: {}".format(type(e).__name__, e)
+            warnings.warn("Skipped undecodable change form {}: {}".format(
+                self.formid, self.d['error']))
+
+    def _decodeData(self, data):
         if self.type == 0:  # REFR
-            sdata = BytesIO(data)
+            sdata = Cursor(data)
             if self.formid.value >= 0xFF000000:
                 initialType = 5  # No hits
             elif self.changeFlags & (_ChangeForm_flags['CHANGE_REFR_PROMOTED'] |
@@ -297,19 +425,13 @@ class ChangeForm(object):
                                  _ChangeForm_flags['CHANGE_REFR_LEVELED_INVENTORY']):
                 if self.changeFlags & extra_data_flags:
                     self.d['extraData'] = unpack("ExtraData", sdata)
-                invcount = unpack("vsval", sdata)
-    #            cf.items = [unpack("InventoryItem", sdata) for i in range(invcount)]
                 self.d['inventory'] = []
-                for i in range(invcount):
-                    inv_item = unpack("InventoryItem", sdata)
-                    if inv_item.item.value == 0x000001F4:
-                        continue  # Skip "Unarmed" item, since it's not an item
-                    self.d['inventory'].append(inv_item)
+                readInventory(sdata, self.d['inventory'])
             # Skip Animation
             # Skip Explosion
 
         elif self.type == 1 and self.formid.value == 0x14:  # Player ACHR
-            sdata = BytesIO(self.data)
+            sdata = Cursor(self.data)
             if self.formid.value >= 0xFF000000:
                 initialType = 5  # No hits
             elif self.changeFlags & (_ChangeForm_flags['CHANGE_REFR_PROMOTED'] |
@@ -341,13 +463,8 @@ class ChangeForm(object):
                 sdata.read(8)  # Unknown
                 if self.changeFlags & extra_data_flags:
                     self.d['extraData'] = unpack("ExtraData", sdata)
-                invcount = unpack("vsval", sdata)
                 self.d['inventory'] = []
-                for i in range(invcount):
-                    inv_item = unpack("InventoryItem", sdata)
-                    if inv_item.item.value == 0x000001F4:
-                        continue  # Skip "Unarmed" item, since it's not an item
-                    self.d['inventory'].append(inv_item)
+                readInventory(sdata, self.d['inventory'])
 
         elif self.type == 16:  # INGR
             self.d['ingr_data'] = unpack("uint32", data)
@@ -442,8 +559,7 @@ class MagicTarget(object):
         self.ref = unpack("RefID", f)
         unpack("uint8", f)
         unpack("vsval", f)
-        count = unpack("RefID", f)
-        self.data = [unpack("uint8", f) for i in range(count)]
+        raise NotImplementedError("MagicTarget data")
     def __repr__(self):
         return "MagicTarget<{}>".format()
 
@@ -489,201 +605,194 @@ class AttachedArrows3D(object):
 _types["AttachedArrows3D"] = AttachedArrows3D
 
 
+#%% Extra data decoders
+# Primitive fields that fit in a single struct
+_extra_codes = {"int8": "b", "uint8": "B", "uint16": "H", "int32": "i",
+                "uint32": "I", "float": "f"}
+
+
+def _extraFields(*types):
+    """Compile a decoder reading fields of the given types into a list."""
+    if all(t in _extra_codes for t in types):
+        st = struct.Struct("<" + "".join(_extra_codes[t] for t in types))
+        unpack_from = st.unpack_from
+        size = st.size
+
+        def decode(f):
+            data = list(unpack_from(f.buf, f.pos))
+            f.pos += size
+            return data
+    else:
+        readers = [getattr(Cursor, t, None) or _types[t] for t in types]
+
+        def decode(f):
+            return [read(f) for read in readers]
+    return decode
+
+
+def _extraCounted(*types):
+    """Compile a decoder for a vsval count of items with the given fields.
+
+    Items are tuples, or plain values if they have a single field.
+    """
+    fields = _extraFields(*types)
+    if len(types) == 1:
+        def decode(f):
+            return [fields(f)[0] for i in range(f.vsval())]
+    else:
+        def decode(f):
+            return [tuple(fields(f)) for i in range(f.vsval())]
+    return decode
+
+
+def _extraSeq(*decoders):
+    """Chain decoders, concatenating their lists."""
+    def decode(f):
+        data = []
+        for decoder in decoders:
+            data.extend(decoder(f))
+        return data
+    return decode
+
+
+def _extra_TresPassPackage(f):
+    data = [f.RefID()]
+    if data[0].value != 0:
+        raise NotImplementedError("There's more unknown data")
+    return data
+
+
+def _extra_LeveledCreature(f):
+    data = [f.RefID(), f.RefID(), f.uint32()]
+    if data[2] != 0:  # NPC_ change form data of unknown layout follows
+        raise NotImplementedError("LeveledCreature NPC data")
+    return data
+
+
+def _extra_DismemberedLimbs(f):
+    data = _extraFields("uint16", "uint8", "uint32", "RefID")(f)
+    limbs = _extraFields("uint8", "uint8", "uint8", "uint8")
+    for i in range(f.vsval()):
+        limb = limbs(f)
+        limb.append([f.RefID() for j in range(f.vsval())])
+        data.append(tuple(limb))
+    return data
+
+
+def _extra_PackageData(f):
+    data = [f.int8()]
+    if data[0] != -1:
+        raise NotImplementedError("There's more unknown data")
+    return data
+
+
+def _extra_TextDisplayData(f):
+    data = [f.RefID(), f.RefID(), f.int32()]
+    if data[2] == -2 and data[0].value == 0 and data[1].value == 0:
+        data.append(f.wstring())
+    return data
+
+
+_extra_RefID = _extraFields("RefID")
+_extra_uint8 = _extraFields("uint8")
+_extra_uint32 = _extraFields("uint32")
+_extra_float = _extraFields("float")
+_extra_RefID_uint32 = _extraFields("RefID", "uint32")
+
+# Decoder of each extra data type. None means the type has no data.
+_extraDataDecoders = {
+    22: None,
+    23: None,
+    24: _extraFields("RefID", "float", "float", "float", "float"),
+    25: _extraFields("RefID", "RefID", "uint32", "uint8", "uint8", "uint8"),
+    26: _extra_TresPassPackage,
+    27: _extraCounted("RefID", "uint8"),
+    28: _extra_RefID,
+    29: None,
+    30: _extra_uint32,
+    31: _extra_uint8,
+    32: _extra_RefID,
+    33: _extra_RefID,
+    34: _extra_RefID,
+    35: _extra_RefID,
+    36: _extraFields("uint16"),
+    37: _extra_float,
+    39: _extra_uint32,
+    40: _extra_float,
+    42: _extraFields("uint8", "uint8", "RefID", "uint32", "uint32"),
+    43: _extraFields(*(["float"]*6 + ["uint8", "RefID"])),
+    44: _extra_uint8,
+    45: _extra_LeveledCreature,
+    46: _extraFields("uint32", "uint8"),
+    47: _extra_float,
+    49: _extraFields("MagicCaster"),
+    50: _extraSeq(_extra_RefID, _extraCounted("MagicTarget")),
+    52: _extraCounted("uint32", "uint32"),
+    56: _extra_RefID,
+    62: _extra_RefID_uint32,
+    68: _extraCounted("float"),
+    69: _extra_RefID,
+    72: _extra_RefID,
+    73: _extra_uint8,
+    76: _extraFields(*(["wstring"] + ["uint8"]*5 + ["RefID"]*4)),
+    77: _extra_uint8,
+    79: _extraFields("uint8", "uint8"),
+    83: _extra_uint32,
+    84: _extra_uint8,
+    85: _extra_float,
+    88: _extra_RefID_uint32,
+    89: _extra_uint32,
+    91: _extraSeq(_extraCounted("RefID", "int8"), _extraFields("RefID", "int8")),
+    92: _extra_DismemberedLimbs,
+    93: _extra_uint32,
+    101: _extra_RefID,
+    104: _extra_RefID,
+    106: _extra_RefID_uint32,
+    108: _extra_PackageData,
+    111: _extraCounted("RefID", "uint32", "uint32"),
+    112: _extra_RefID,
+    113: _extraFields("RefID", "uint8", "RefID", "uint32"),
+    120: _extraCounted("RefID", "uint32", "uint8"),
+    133: _extra_RefID,
+    135: _extraSeq(_extraFields("float", "float", "float", "RefID", "uint32"),
+                   _extraCounted("float", "float", "float", "RefID",
+                                 "float", "float", "float", "RefID",
+                                 "uint8")),
+    136: _extraCounted("RefID", "uint32"),
+    140: _extraCounted("RefID"),
+    142: _extra_RefID,
+    146: _extra_RefID,
+    149: _extra_RefID_uint32,
+    150: _extra_uint8,
+    152: _extraFields("AttachedArrows3D"),
+    153: _extra_TextDisplayData,
+    155: _extraFields("RefID", "uint16"),
+    156: _extra_uint8,
+    157: _extra_RefID,
+    159: _extraFields("uint32", "uint16"),
+    160: _extra_uint32,
+    161: _extraFields(*(["float"]*(3*6) + ["uint32"]*4)),
+    164: _extra_RefID,
+    169: _extraFields("uint32", "RefID", "RefID", "uint8"),
+    174: _extraFields("RefID", "wstring", "float", "float", "float",
+                      "float", "float", "float", "float"),
+    175: _extra_RefID,
+    176: _extra_RefID,
+}
+
+
 class ExtraDataType(object):
-    def __init__(self, f):
-        type_ = unpack("uint8", f)
+    def __init__(self, f):  # f is a Cursor
+        type_ = f.uint8()
         self.type = type_
-        self.typeName = _dataTypeNames[type_]
-        if type_ == 22:
-            pass
-        elif type_ == 23:
-            pass
-        elif type_ == 24:
-            self.data = [unpack("RefID", f), unpack("float", f),
-                         unpack("float", f), unpack("float", f),
-                         unpack("float", f)]
-        elif type_ == 25:
-            self.data = [unpack("RefID", f), unpack("RefID", f),
-                         unpack("uint32", f), unpack("uint8", f),
-                         unpack("uint8", f), unpack("uint8", f)]
-        elif type_ == 26:
-            self.data = [unpack("RefID", f)]
-            if self.data[0].value != 0:
-                raise NotImplementedError("There's more unknown data")
-        elif type_ == 27:
-            count = unpack("vsval", f)
-            self.data = [(unpack("RefID", f), unpack("uint8", f)) for i in range(count)]
-        elif type_ == 28:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 29:
-            pass
-        elif type_ == 30:
-            self.data = [unpack("uint32", f)]
-        elif type_ == 31:
-            self.data = [unpack("uint8", f)]
-        elif type_ == 32:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 33:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 34:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 35:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 36:
-            self.data = [unpack("uint16", f)]
-        elif type_ == 37:
-            self.data = [unpack("float", f)]
-        elif type_ == 39:
-            self.data = [unpack("uint32", f)]
-        elif type_ == 40:
-            self.data = [unpack("float", f)]
-        elif type_ == 42:
-            self.data = [unpack("uint8", f), unpack("uint8", f),
-                         unpack("RefID", f), unpack("uint32", f),
-                         unpack("uint32", f)]
-        elif type_ == 43:
-            self.data = [unpack("float", f) for i in range(6)]
-            self.data.extend([unpack("uint8", f), unpack("RefID", f)])
-        elif type_ == 44:
-            self.data = [unpack("uint8", f)]
-        elif type_ == 45:
-            raise NotImplementedError("Too big for now")  # TODO: fix
-        elif type_ == 46:
-            self.data = [unpack("uint32", f), unpack("uint8", f)]
-        elif type_ == 47:
-            self.data = [unpack("float", f)]
-        elif type_ == 49:
-            self.data = [unpack("MagicCaster", f)]
-        elif type_ == 50:
-            self.data = [unpack("RefID", f)]
-            count = unpack("vsval", f)
-            self.data.extend([unpack("MagicTarget", f) for i in range(count)])
-        elif type_ == 52:
-            count = unpack("vsval", f)
-            self.data = [(unpack("uint32", f), unpack("uint32", f)) for i in
-                         range(count)]
-        elif type_ == 56:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 62:
-            self.data = [unpack("RefID", f), unpack("uint32", f)]
-        elif type_ == 68:
-            count = unpack("vsval", f)
-            self.data = [unpack("float", f) for i in range(count)]
-        elif type_ == 69:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 72:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 73:
-            self.data = [unpack("uint8", f)]
-        elif type_ == 76:
-            self.data = [unpack("wstring", f)]
-            self.data.extend([unpack("uint8", f) for i in range(5)])
-            self.data.extend([unpack("RefID", f) for i in range(4)])
-        elif type_ == 77:
-            self.data = [unpack("uint8", f)]
-        elif type_ == 79:
-            self.data = [unpack("uint8", f), unpack("uint8", f)]
-        elif type_ == 83:
-            self.data = [unpack("uint32", f)]
-        elif type_ == 84:
-            self.data = [unpack("uint8", f)]
-        elif type_ == 85:
-            self.data = [unpack("float", f)]
-        elif type_ == 88:
-            self.data = [unpack("RefID", f), unpack("uint32", f)]
-        elif type_ == 89:
-            self.data = [unpack("uint32", f)]
-        elif type_ == 91:
-            count = unpack("vsval", f)
-            self.data = [(unpack("RefID", f), unpack("int8", f)) for i in range(count)]
-            self.data.append(unpack("RefID", f))
-            self.data.append(unpack("int8", f))
-        elif type_ == 92:
-            raise NotImplementedError("Too big for now")  # TODO: fix
-        elif type_ == 93:
-            self.data = [unpack("uint32", f)]
-        elif type_ == 101:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 104:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 106:
-            self.data = [unpack("RefID", f), unpack("uint32", f)]
-        elif type_ == 108:
-            self.data = [unpack("uint8", f)]
-            if self.data != -1:
-                raise NotImplementedError("There's more unknown data")
-        elif type_ == 111:
-            count = unpack("vsval", f)
-            self.data = [(unpack("RefID", f), unpack("uint32", f),
-                          unpack("uint32", f)) for i in range(count)]
-        elif type_ == 112:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 113:
-            raise NotImplementedError("Too big for now")  # TODO: fix
-        elif type_ == 120:
-            count = unpack("vsval", f)
-            self.data = [(unpack("RefID", f), unpack("uint32", f),
-                          unpack("uint8", f)) for i in range(count)]
-        elif type_ == 133:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 135:
-            self.data = [unpack("float", f), unpack("float", f),
-                         unpack("float", f), unpack("RefID", f),
-                         unpack("uint32", f)]
-            count = unpack("vsval", f)
-            self.data.extend([(unpack("float", f), unpack("float", f),
-                               unpack("float", f), unpack("RefID", f),
-                               unpack("float", f), unpack("float", f),
-                               unpack("float", f), unpack("RefID", f),
-                               unpack("uint8", f)) for i in range(count)])
-        elif type_ == 136:
-            count = unpack("vsval", f)
-            self.data = [(unpack("RefID", f), unpack("uint32", f)) for i in range(count)]
-        elif type_ == 140:
-            count = unpack("vsval", f)
-            self.data = [unpack("RefID", f) for i in range(count)]
-        elif type_ == 142:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 146:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 149:
-            self.data = [unpack("RefID", f), unpack("uint32", f)]
-        elif type_ == 150:
-            self.data = [unpack("uint8", f)]
-        elif type_ == 152:
-            self.data = [unpack("AttachedArrows3D", f)]
-        elif type_ == 153:
-            self.data = [unpack("RefID", f), unpack("RefID", f),
-                         unpack("int32", f)]
-            if (self.data[2] == -2 and self.data[0].value == 0 and
-                self.data[1].value == 0):
-                    self.data.append(unpack("wstring", f))
-        elif type_ == 155:
-            self.data = [unpack("RefID", f), unpack("uint16", f)]
-        elif type_ == 156:
-            self.data = [unpack("uint8", f)]
-        elif type_ == 157:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 159:
-            self.data = [unpack("uint32", f), unpack("uint16", f)]
-        elif type_ == 160:
-            self.data = [unpack("uint32", f)]
-        elif type_ == 161:
-            self.data = [unpack("float", f) for i in range(3*6)]
-            self.data.extend([unpack("uint32", f) for i in range(4)])
-        elif type_ == 164:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 169:
-            self.data = [unpack("uint32", f), unpack("RefID", f),
-                         unpack("RefID", f), unpack("uint8", f)]
-        elif type_ == 174:
-            raise NotImplementedError("Too big for now")  # TODO: fix
-        elif type_ == 175:
-            self.data = [unpack("RefID", f)]
-        elif type_ == 176:
-            self.data = [unpack("RefID", f)]
-        else:
-            raise RuntimeError("Shouldn't get here! ExtraDataType = %d" % type_)
+        self.typeName = _dataTypeNames.get(type_, "Unknown")
+        try:
+            decoder = _extraDataDecoders[type_]
+        except KeyError:
+            raise NotImplementedError("Unknown layout of ExtraDataType "
+                                      "{} ({})".format(type_, self.typeName))
+        if decoder is not None:
+            self.data = decoder(f)
 #        self.changeFlags = unpack("uint32", f)
 
     def __repr__(self):
@@ -693,9 +802,9 @@ _types["ExtraDataType"] = ExtraDataType
 
 
 class ExtraData(object):
-    def __init__(self, f):
-        self.count = unpack("vsval", f)
-        self.data = [unpack("ExtraDataType", f) for i in range(self.count)]
+    def __init__(self, f):  # f is a Cursor
+        self.count = f.vsval()
+        self.data = [ExtraDataType(f) for i in range(self.count)]
 
     def __repr__(self):
         return "ExtraData<>".format()
@@ -704,11 +813,11 @@ _types["ExtraData"] = ExtraData
 
 
 class InventoryItem(object):
-    def __init__(self, f):
-        self.item = unpack("RefID", f)
-        self.itemcount = unpack("int32", f)
-        extracount = unpack("vsval", f)
-        self.extraData = [unpack("ExtraData", f) for i in range(extracount)]
+    def __init__(self, f):  # f is a Cursor
+        self.item = f.RefID()
+        self.itemcount = f.int32()
+        extracount = f.vsval()
+        self.extraData = [ExtraData(f) for i in range(extracount)]
 #        print "Position", f.tell()
 
     def __repr__(self):
@@ -717,6 +826,199 @@ class InventoryItem(object):
 
 _types["InventoryItem"] = InventoryItem
 
+# Bounds of plausible inventory items, see readInventory
+_item_max_count = 1 << 16
+_item_max_extra = 16
+
+
+def _plausibleItems(f, count):
+    """Whether `count` inventory items with plausible values decode from f."""
+    try:
+        for i in range(count):
+            item = f.RefID()
+            itemcount = f.int32()
+            if (item.type_ == 3 or item.value == 0 or
+                    not 0 < abs(itemcount) < _item_max_count):
+                return False
+            extracount = f.vsval()
+            if extracount > _item_max_extra:
+                return False
+            for j in range(extracount):
+                if ExtraData(f).count > _item_max_extra:
+                    return False
+    except (struct.error, NotImplementedError, IndexError,
+            UnicodeDecodeError):
+        return False
+    return True
+
+
+def readInventory(f, items):
+    """Decode a vsval counted inventory list, appending the items to `items`.
+
+    Extra data entries aren't length prefixed, so when one has an unknown
+    layout the rest of its item can't be decoded. That item is kept with
+    extraData None, and the next one is looked for byte by byte: decoding
+    goes on from the offset where all the remaining items decode with known
+    layouts and plausible IDs and counts. Garbage can pass that test too, so
+    unless exactly one offset does, the error is raised.
+    """
+    invcount = f.vsval()
+    for i in range(invcount):
+        start = f.pos
+        try:
+            inv_item = InventoryItem(f)
+        except NotImplementedError as e:
+            f.seek(start)
+            inv_item = InventoryItem.__new__(InventoryItem)
+            inv_item.item = f.RefID()
+            inv_item.itemcount = f.int32()
+            inv_item.extraData = None
+            remaining = invcount - i - 1
+            if remaining:
+                candidates = []
+                for pos in range(f.pos + 1, len(f.buf)):
+                    f.seek(pos)
+                    if _plausibleItems(f, remaining):
+                        candidates.append(pos)
+                if len(candidates) != 1:
+                    raise
+                f.seek(candidates[0])
+            warnings.warn("Skipped extra data of {}: {}".format(inv_item, e))
+        if inv_item.item.value == 0x000001F4:
+            continue  # Skip "Unarmed" item, since it's not an item
+        items.append(inv_item)
+
+
+#%% Record schemas
+_field_header = struct.Struct("<4sH")
+_record_header = struct.Struct("<IIIIHH")
+_formid = struct.Struct("<I")
+_efit = struct.Struct("<fII")
+
+# {master index in the plugin being read: load order index}, see
+# setFormIDMap. None keeps form IDs as they are in the file.
+_formid_map = None
+
+
+def setFormIDMap(formid_map):
+    """Set how form IDs of the plugin being read map to load order.
+
+    The top byte of a form ID in a plugin is an index into its masters
+    list, the plugin itself coming after them. `formid_map` maps those to
+    load order indices (see skyrimdata.extractPlugins); None turns the
+    remapping off.
+    """
+    global _formid_map
+    _formid_map = formid_map
+
+
+def remapFormID(formid):
+    """Form ID from the plugin being read, in load order."""
+    if _formid_map is None:
+        return formid
+    index = _formid_map.get(formid >> 24)
+    if index is None:
+        return formid
+    return (index << 24) | (formid & 0xFFFFFF)
+
+
+def readMasters(fd):
+    """Masters (MAST) of a plugin file, from its TES4 header record."""
+    fd.seek(0)
+    header = fd.read(4 + _record_header.size)
+    dataSize = _record_header.unpack_from(header, 4)[0]
+    data = fd.read(dataSize)
+    masters = []
+    offset = 0
+    while offset < len(data):
+        type_, size = _field_header.unpack_from(data, offset)
+        offset += _field_header.size
+        if type_ == b"MAST":
+            masters.append(zstring_from(data, offset)[0])
+        offset += size
+    return masters
+
+
+def flagNames(bits):
+    """Converter from a flags integer to the list of names of set bits."""
+    def convert(flags):
+        return [v for k, v in bits.items() if k & flags]
+    return convert
+
+
+class Layout(object):
+    """Fixed binary layout of a subrecord, decoded with one unpack_from.
+
+    `fields` are (name, type) or (name, type, convert) tuples, with types
+    from `skyrimtypes`. An int type skips that many padding bytes. Values are
+    set as attributes of the record being decoded.
+    """
+    def __init__(self, *fields):
+        self.fields = fields
+
+    def compile(self):
+        fmt = ["<"]
+        setters = []
+        for field in self.fields:
+            name, type_ = field[:2]
+            convert = field[2] if len(field) > 2 else None
+            if isinstance(type_, int):
+                fmt.append("{}x".format(type_))
+                continue
+            if type_ == "lstring":
+                fmt.append("I")
+                if convert is None:
+                    convert = get_lstring
+                else:
+                    convert = (lambda c: lambda v: c(get_lstring(v)))(convert)
+            else:
+                fmt.append(_types[type_].format)
+                if type_ == "formid" and convert is None:
+                    convert = remapFormID
+            setters.append((len(setters), name, convert))
+        unpack_from = struct.Struct("".join(fmt)).unpack_from
+        if all(convert is None for i, name, convert in setters):
+            names = [name for i, name, convert in setters]
+
+            def decode(record, data, offset, size):
+                record.__dict__.update(zip(names, unpack_from(data, offset)))
+            return decode
+
+        def decode(record, data, offset, size):
+            values = unpack_from(data, offset)
+            for i, name, convert in setters:
+                if convert is None:
+                    setattr(record, name, values[i])
+                else:
+                    setattr(record, name, convert(values[i]))
+        return decode
+
+
+def _zstring_decoder(name):
+    def decode(record, data, offset, size):
+        setattr(record, name, zstring_from(data, offset)[0])
+    return decode
+
+
+def compileSchema(schema):
+    """Compile a {subrecord type: spec} schema into a dispatch dict.
+
+    A spec is a Layout, a single (name, type[, convert]) field, or a
+    function called with (record, data, offset, size). Keys of the returned
+    dict are the raw subrecord types, as bytes.
+    """
+    dispatch = {}
+    for type_, spec in schema.items():
+        if isinstance(spec, tuple):
+            if spec[1] == "zstring":
+                spec = _zstring_decoder(spec[0])
+            else:
+                spec = Layout(spec)
+        if isinstance(spec, Layout):
+            spec = spec.compile()
+        dispatch[type_.encode("ascii")] = spec
+    return dispatch
+
 
 #%% Field
 class Field(object):
@@ -731,45 +1033,52 @@ _types["Field"] = Field
 
 #%% Record
 class Record(object):
-    def __init__(self, fd, type_):
+    """Generic ESM record.
+
+    Subclasses declare a `_schema` built with `compileSchema`, which decodes
+    their subrecords straight from the record data. Records without one
+    keep their raw subrecords in `fields`. `data` is the record data when it
+    was already decompressed.
+    """
+    _schema = None
+
+    def __init__(self, fd, type_, data=None):
         self.type = type_
-        dataSize = unpack("uint32", fd)
-#        if type_ == "GRUP":
-#            self.label = fd.read(4).decode("cp1252")
-#            self.groupType = unpack("int32", fd)
-#            self.stamp = unpack("uint16", fd)
-#            unpack("uint16", fd)  # Unknown
-#            self.version = unpack("uint16", fd)
-#            unpack("uint16", fd)  # Unknown
-##            children = []
-##            group_end = fd.tell() + self.size - 24
-##            while fd.tell() < group_end:
-##                type_ = f.read(4).decode("cp1252")
-##                children.append(Record(fd, type_))
-##            self.children = children
-##            self.data = fd.read(self.size - 24)
-#            if self.label in _read_record_types:
-#                data = BytesIO(fd.read(self.size - 24))
-#            else:  # skip
-#                fd.seek(fd.tell() + self.size - 24)
-#            return
-        self.flags = unpack("uint32", fd)
-        self.id = unpack("uint32", fd)
-        self.revision = unpack("uint32", fd)
-        self.version = unpack("uint16", fd)
-        unpack("uint16", fd)  # Unknown
-        if self.flags & 0x00040000:  # Data is compressed
+        (dataSize, self.flags, self.id, self.revision, self.version,
+         unknown) = _record_header.unpack(fd.read(_record_header.size))
+        self.id = remapFormID(self.id)
+        if data is not None:  # Already decompressed, see Group
+            fd.seek(dataSize, 1)
+            dataSize = len(data)
+        elif self.flags & 0x00040000:  # Data is compressed
             decompSize = unpack("uint32", fd)
             compData = fd.read(dataSize - 4)
             data = zlib.decompress(compData, 0, decompSize)
             dataSize = decompSize
         else:
             data = fd.read(dataSize)
-        data = BytesIO(data)
+        if self._schema is not None:
+            self._decode(data)
+            return
+        data = Cursor(data)
         fields = []
         while data.tell() < dataSize:
             fields.append(Field(data))
         self.fields = fields
+
+    def _decode(self, data):
+        get = self._schema.get
+        unpack_from = _field_header.unpack_from
+        offset = 0
+        end = len(data)
+        while offset < end:
+            type_, size = unpack_from(data, offset)
+            offset += 6
+            decode = get(type_)
+            if decode is not None:
+                decode(self, data, offset, size)
+            offset += size
+
     def __repr__(self):
         if self.type == "GRUP":
             return "{}:{}".format(self.type, self.label)
@@ -807,27 +1116,30 @@ class Effect(object):
 _types["Effect"] = Effect
 
 
+def _read_efid(record, data, offset, size):
+    record.effects.append(Effect(remapFormID(
+        _formid.unpack_from(data, offset)[0])))
+
+
+def _read_efit(record, data, offset, size):
+    effect = record.effects[-1]
+    (effect.Magnitude, effect.AreaOfEffect,
+     effect.Duration) = _efit.unpack_from(data, offset)
+
+
 class INGR(Record):
-    def __init__(self, fd, type_="INGR"):
-        super(INGR, self).__init__(fd, type_)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": ("FullName", "lstring"),
+        "DATA": Layout(("Value", "uint32"), ("Weight", "float")),
+        "EFID": _read_efid,
+        "EFIT": _read_efit,
+    })
+
+    def __init__(self, fd, type_="INGR", data=None):
         self.effects = []
         self.FullName = "Nameless"
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                self.FullName = unpack("lstring", field.data)
-            elif field.type == "DATA":
-                self.Value = unpack("uint32", field.data[:4])
-                self.Weight = unpack("float", field.data[4:])
-            elif field.type == "EFID":
-                self.effects.append(Effect(unpack("formid", field.data)))
-            elif field.type == "EFIT":
-                last_effect = self.effects[-1]
-                last_effect.Magnitude = unpack("float", field.data[:4])
-                last_effect.AreaOfEffect = unpack("uint32", field.data[4:8])
-                last_effect.Duration = unpack("uint32", field.data[8:])
-        if self.id == 0x3ad5d: import pdb; pdb.set_trace()
+        super(INGR, self).__init__(fd, type_, data)
         db['INGR'][self.id] = self
 
     def __repr__(self):
@@ -836,6 +1148,20 @@ class INGR(Record):
 _types["INGR"] = INGR
 
 
+def _read_mgef_full(record, data, offset, size):
+    id_ = _formid.unpack_from(data, offset)[0]
+    if record.id < 0x01000000:
+        record.FullName = get_lstring(id_)
+    else:
+        # TODO: find where DLC strings are
+        record.FullName = "DLC string: {}".format(id_)
+
+
+def _read_kwda(record, data, offset, size):
+    record.KWDA = [remapFormID(formid) for formid in
+                   struct.unpack_from("<{}I".format(size // 4), data, offset)]
+
+
 class MGEF(Record):
     """Magic Effect.
 
@@ -844,43 +1170,25 @@ class MGEF(Record):
     Reference:
         http://en.m.uesp.net/wiki/Tes5Mod:Mod_File_Format/MGEF
     """
-    def __init__(self, fd, type_="MGEF"):
-        super(MGEF, self).__init__(fd, type_)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": _read_mgef_full,
+        "KWDA": _read_kwda,
+        "DATA": Layout(("Flags", "uint32"), ("BaseCost", "float"),
+                       ("RelatedID", "formid"), ("Skill", "int32"),
+                       ("ResistanceAV", "uint32"), (None, 16),
+                       ("SkillLevel", "uint32"), ("Area", "uint32"),
+                       ("CastingTime", "float"), (None, 12),
+                       ("EffectType", "uint32"), ("PrimaryAV", "int32")),
+        "ESCE": ("CounterEffects", "formid"),
+        "DNAM": ("Description", "lstring",
+                 lambda desc: desc.translate({ord('<'): ord('{'),
+                                              ord('>'): ord('}')})),
+    })
+
+    def __init__(self, fd, type_="MGEF", data=None):
         self.FullName = "Unnamed"
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                if self.id < 0x01000000:
-                    self.FullName = unpack("lstring", field.data)
-                else:
-                    # TODO: find where DLC strings are
-                    self.FullName = "DLC string: {}".format(unpack('formid', field.data))
-            elif field.type == "KSIZ":
-                ksiz = unpack("uint32", field.data)
-            elif field.type == "KWDA":
-                sdata = BytesIO(field.data)
-                self.KWDA = [unpack("formid", sdata) for i in range(ksiz)]
-            elif field.type == "DATA":
-                fdata = BytesIO(field.data)
-                self.Flags = unpack("uint32", fdata)
-                self.BaseCost = unpack("float", fdata)
-                self.RelatedID = unpack("formid", fdata)
-                self.Skill = unpack("int32", fdata)
-                self.ResistanceAV = unpack("uint32", fdata)
-                fdata.read(16)
-                self.SkillLevel = unpack("uint32", fdata)
-                self.Area = unpack("uint32", fdata)
-                self.CastingTime = unpack("float", fdata)
-                fdata.read(12)
-                self.EffectType = unpack("uint32", fdata)
-                self.PrimaryAV = unpack("int32", fdata)
-            elif field.type == "ESCE":
-                self.CounterEffects = unpack("formid", field.data)
-            elif field.type == "DNAM":
-                desc = unpack("lstring", field.data)
-                self.Description = desc.translate({ord(c): ord(t) for c, t in
-                                                   [('<','{'), ('>', '}')]})
+        super(MGEF, self).__init__(fd, type_, data)
         db['MGEF'][self.id] = self
 
     @property
@@ -899,30 +1207,22 @@ _types["MGEF"] = MGEF
 
 
 class ALCH(Record):
-    def __init__(self, fd, type_="ALCH"):
-        super(ALCH, self).__init__(fd, type_)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": ("FullName", "lstring"),
+        "DATA": ("Weight", "float"),
+        "ENIT": Layout(("Value", "uint32"),
+                       ("Flags", "uint32",
+                        flagNames({0x1: "ManualCalc", 0x2: "Food",
+                                   0x10000: "Medicine", 0x20000: "Poison"}))),
+        "EFID": _read_efid,
+        "EFIT": _read_efit,
+    })
+
+    def __init__(self, fd, type_="ALCH", data=None):
         self.effects = []
         self.FullName = "Unnamed"
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                self.FullName = unpack("lstring", field.data)
-            elif field.type == "DATA":
-                self.Weight = unpack("float", field.data)
-            elif field.type == "ENIT":
-                self.Value = unpack("uint32", field.data[:4])
-                flags = unpack("uint32", field.data[4:8])
-                flag_bits = {0x1: "ManualCalc", 0x2: "Food",
-                             0x10000: "Medicine", 0x20000: "Poison"}
-                self.Flags = [v for k, v in flag_bits.items() if k & flags]
-            elif field.type == "EFID":
-                self.effects.append(Effect(unpack("formid", field.data)))
-            elif field.type == "EFIT":
-                last_effect = self.effects[-1]
-                last_effect.Magnitude = unpack("float", field.data[:4])
-                last_effect.AreaOfEffect = unpack("uint32", field.data[4:8])
-                last_effect.Duration = unpack("uint32", field.data[8:])
+        super(ALCH, self).__init__(fd, type_, data)
         db['ALCH'][self.id] = self
 
     def __repr__(self):
@@ -947,7 +1247,7 @@ class EnchantedItem(object):
         self.EnchantType = {0x06: "Enchantment", 0x0C: "Staff Enchantment"
                          }[unpack("uint32", f)]
         self.ChargeTime = unpack("float", f)
-        self.BaseEnchantment = unpack("formid", f)
+        self.BaseEnchantment = remapFormID(unpack("formid", f))
 
     def __repr__(self):
         return "EnchantedItem<>".format()
@@ -955,25 +1255,23 @@ class EnchantedItem(object):
 _types["EnchantedItem"] = EnchantedItem
 
 
+def _read_ench_enit(record, data, offset, size):
+    record.ArmorRating = EnchantedItem(Cursor(data, offset))
+
+
 class ENCH(Record):
-    def __init__(self, fd, type_="ENCH"):
-        super(ENCH, self).__init__(fd, type_)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": ("FullName", "lstring"),
+        "ENIT": _read_ench_enit,
+        "EFID": _read_efid,
+        "EFIT": _read_efit,
+    })
+
+    def __init__(self, fd, type_="ENCH", data=None):
         self.effects = []
         self.FullName = "Unnamed"
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                self.FullName = unpack("lstring", field.data)
-            elif field.type == "ENIT":
-                self.ArmorRating = unpack("EnchantedItem", BytesIO(field.data))
-            elif field.type == "EFID":
-                self.effects.append(Effect(unpack("formid", field.data)))
-            elif field.type == "EFIT":
-                last_effect = self.effects[-1]
-                last_effect.Magnitude = unpack("float", field.data[:4])
-                last_effect.AreaOfEffect = unpack("uint32", field.data[4:8])
-                last_effect.Duration = unpack("uint32", field.data[8:])
+        super(ENCH, self).__init__(fd, type_, data)
         db['ENCH'][self.id] = self
 
     @property
@@ -987,26 +1285,20 @@ _types["ENCH"] = ENCH
 
 
 class ARMO(Record):
-    def __init__(self, fd, type_="ARMO"):
-        super(ARMO, self).__init__(fd, type_)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": ("FullName", "lstring"),
+        "EITM": ("enchantment_id", "formid"),
+        "EAMT": ("enchantment_amount", "uint16"),
+        "DESC": ("Description", "lstring"),
+        "DATA": Layout(("BaseValue", "uint32"), ("Weight", "float")),
+        "DNAM": ("ArmorRating", "uint32"),
+    })
+
+    def __init__(self, fd, type_="ARMO", data=None):
         self.FullName = "Unnamed"
         self.enchantment_id = 0
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                self.FullName = unpack("lstring", field.data)
-            elif field.type == "EITM":
-                self.enchantment_id = unpack("formid", field.data)
-            elif field.type == "EAMT":
-                self.enchantment_amount = unpack("uint16", field.data)
-            elif field.type == "DESC":
-                self.Description = unpack("lstring", field.data)
-            elif field.type == "DATA":
-                self.BaseValue = unpack("uint32", field.data[:4])
-                self.Weight = unpack("float", field.data[4:])
-            elif field.type == "DNAM":
-                self.ArmorRating = unpack("uint32", field.data)
+        super(ARMO, self).__init__(fd, type_, data)
         db['ARMO'][self.id] = self
 
     @property
@@ -1027,17 +1319,15 @@ _types["ARMO"] = ARMO
 
 
 class MISC(Record):
-    def __init__(self, fd, type_="MISC"):
-        super(MISC, self).__init__(fd, type_)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": ("FullName", "lstring"),
+        "DATA": Layout(("Value", "uint32"), ("Weight", "float")),
+    })
+
+    def __init__(self, fd, type_="MISC", data=None):
         self.FullName = "Unnamed"
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                self.FullName = unpack("lstring", field.data)
-            elif field.type == "DATA":
-                self.Value = unpack("uint32", field.data[:4])
-                self.Weight = unpack("float", field.data[4:])
+        super(MISC, self).__init__(fd, type_, data)
         db['MISC'][self.id] = self
 
     def __repr__(self):
@@ -1047,27 +1337,19 @@ _types["MISC"] = MISC
 
 
 class SCRL(Record):
-    def __init__(self, fd, type_="SCRL"):
-        super(SCRL, self).__init__(fd, type_)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": ("FullName", "lstring"),
+        "DESC": ("Description", "lstring"),
+        "DATA": Layout(("Value", "uint32"), ("Weight", "float")),
+        "EFID": _read_efid,
+        "EFIT": _read_efit,
+    })
+
+    def __init__(self, fd, type_="SCRL", data=None):
         self.effects = []
         self.FullName = "Unnamed"
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                self.FullName = unpack("lstring", field.data)
-            elif field.type == "DESC":
-                self.Description = unpack("lstring", field.data)
-            elif field.type == "DATA":
-                self.Value = unpack("uint32", field.data[:4])
-                self.Weight = unpack("float", field.data[4:])
-            elif field.type == "EFID":
-                self.effects.append(Effect(unpack("formid", field.data)))
-            elif field.type == "EFIT":
-                last_effect = self.effects[-1]
-                last_effect.Magnitude = unpack("float", field.data[:4])
-                last_effect.AreaOfEffect = unpack("uint32", field.data[4:8])
-                last_effect.Duration = unpack("uint32", field.data[8:])
+        super(SCRL, self).__init__(fd, type_, data)
         db['SCRL'][self.id] = self
 
     def __repr__(self):
@@ -1077,32 +1359,25 @@ _types["SCRL"] = SCRL
 
 
 class BOOK(Record):
-    def __init__(self, fd, type_="BOOK"):
-        super(BOOK, self).__init__(fd, type_)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": ("FullName", "lstring"),
+        "DESC": ("Description", "lstring"),
+        "CNAM": ("Description2", "lstring"),
+        "DATA": Layout(("flags", "uint8",
+                        flagNames({0x1: "Teaches Skill", 0x2: "Can't be Taken",
+                                   0x4: "Teaches Spell", 0x8: "Read"})),
+                       ("booktype", "uint8",
+                        {0: "Book/Tome", 255: "Note/Scroll"}.__getitem__),
+                       (None, 2),  # Always 0
+                       ("teaches", "uint32"), ("Value", "uint32"),
+                       ("Weight", "float")),
+    })
+
+    def __init__(self, fd, type_="BOOK", data=None):
         self.effects = []
         self.FullName = "Unnamed"
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                self.FullName = unpack("lstring", field.data)
-            elif field.type == "DESC":
-                self.Description = unpack("lstring", field.data)
-            elif field.type == "CNAM":
-                self.Description2 = unpack("lstring", field.data)
-            elif field.type == "DATA":
-                sdata = BytesIO(field.data)
-                flags = unpack("uint8", sdata)
-                flag_bits = {0x1: "Teaches Skill", 0x2: "Can't be Taken",
-                             0x4: "Teaches Spell", 0x8: "Read"}
-                self.flags = [v for k, v in flag_bits.items() if k & flags]
-                self.booktype = {0: "Book/Tome", 255: "Note/Scroll"
-                                 }[unpack("uint8", sdata)]
-                unpack("uint8", sdata)  # Always 0
-                unpack("uint8", sdata)  # Always 0
-                self.teaches = unpack("uint32", sdata)
-                self.Value = unpack("uint32", sdata)
-                self.Weight = unpack("float", sdata)
+        super(BOOK, self).__init__(fd, type_, data)
         db['BOOK'][self.id] = self
 
     def __repr__(self):
@@ -1112,31 +1387,23 @@ _types["BOOK"] = BOOK
 
 
 class WEAP(Record):
-    def __init__(self, fd, type_="WEAP"):
-        super(WEAP, self).__init__(fd, type_)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": ("FullName", "lstring"),
+        "DESC": ("Description", "lstring"),
+        "CNAM": ("cnam", "formid"),
+        "DATA": Layout(("BaseValue", "uint32"), ("Weight", "float"),
+                       ("damage", "uint16")),
+        "EAMT": ("enchantment_charge", "uint16"),
+        "EITM": ("enchantment_id", "formid"),
+        # TODO: include DNAM field?
+    })
+
+    def __init__(self, fd, type_="WEAP", data=None):
         self.effects = []
         self.FullName = "Unnamed"
         self.enchantment_id = 0
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                self.FullName = unpack("lstring", field.data)
-            elif field.type == "DESC":
-                self.Description = unpack("lstring", field.data)
-            elif field.type == "CNAM":
-                self.cnam = unpack("formid", field.data)
-            elif field.type == "DATA":
-                sdata = BytesIO(field.data)
-                self.BaseValue = unpack("uint32", sdata)
-                self.Weight = unpack("float", sdata)
-                self.damage = unpack("uint16", sdata)
-            elif field.type == "EAMT":
-                self.enchantment_charge = unpack("uint16", field.data)
-            elif field.type == "EITM":
-                self.enchantment_id = unpack("formid", field.data)
-            # TODO: include DNAM field?
-
+        super(WEAP, self).__init__(fd, type_, data)
         db['WEAP'][self.id] = self
 
     @property
@@ -1158,36 +1425,27 @@ _types["WEAP"] = WEAP
 
 
 class AMMO(Record):
-    def __init__(self, fd, type_="AMMO"):
-        super(AMMO, self).__init__(fd, type_)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": ("FullName", "lstring"),
+        "DESC": ("Description", "lstring"),
+        "CNAM": ("cnam", "formid"),
+        "DATA": Layout(("projID", "formid"),
+                       ("flags", "uint32",
+                        flagNames({0x1: "Ignores Normal Weapon Resistance",
+                                   0x2: "Non-Playable",
+                                   0x4: "Non-Bolt"})),
+                       ("damage", "float"), ("Value", "uint32")),
+        "EAMT": ("enchantment_charge", "uint16"),
+        "EITM": ("enchantment", "formid"),
+        # TODO: include DNAM field?
+    })
+
+    def __init__(self, fd, type_="AMMO", data=None):
         self.effects = []
         self.FullName = "Unnamed"
         self.Weight = 0.0
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                self.FullName = unpack("lstring", field.data)
-            elif field.type == "DESC":
-                self.Description = unpack("lstring", field.data)
-            elif field.type == "CNAM":
-                self.cnam = unpack("formid", field.data)
-            elif field.type == "DATA":
-                sdata = BytesIO(field.data)
-                self.projID = unpack("formid", sdata)
-                flags = unpack("uint32", sdata)
-                flag_bits = {0x1: "Ignores Normal Weapon Resistance",
-                             0x2: "Non-Playable",
-                             0x4: "Non-Bolt"}
-                self.flags = [v for k, v in flag_bits.items() if k & flags]
-                self.damage = unpack("float", sdata)
-                self.Value = unpack("uint32", sdata)
-            elif field.type == "EAMT":
-                self.enchantment_charge = unpack("uint16", field.data)
-            elif field.type == "EITM":
-                self.enchantment = unpack("formid", field.data)
-            # TODO: include DNAM field?
-
+        super(AMMO, self).__init__(fd, type_, data)
         db['AMMO'][self.id] = self
 
     def __repr__(self):
@@ -1196,28 +1454,23 @@ class AMMO(Record):
 _types["AMMO"] = AMMO
 
 
+_soul_sizes = {0: "Empty", 1: "Petty", 2: "Lesser", 3: "Common",
+               4: "Greater", 5: "Grand"}
+
+
 class SLGM(Record):
-    def __init__(self, fd, type_="SLGM"):
-        super(SLGM, self).__init__(fd, type_)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": ("FullName", "lstring"),
+        "SOUL": ("soul", "uint8", _soul_sizes.__getitem__),
+        "DATA": Layout(("Value", "uint32"), ("Weight", "float")),
+        "SLCP": ("capacity", "uint8", _soul_sizes.__getitem__),
+    })
+
+    def __init__(self, fd, type_="SLGM", data=None):
         self.effects = []
         self.FullName = "Unnamed"
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                self.FullName = unpack("lstring", field.data)
-            elif field.type == "SOUL":
-                self.soul = {0: "Empty", 1: "Petty", 2: "Lesser", 3: "Common",
-                             4: "Greater", 5: "Grand"
-                             }[unpack("uint8", field.data)]
-            elif field.type == "DATA":
-                self.Value = unpack("uint32", field.data[:4])
-                self.Weight = unpack("float", field.data[4:])
-            elif field.type == "SLCP":
-                self.capacity = {0: "Empty", 1: "Petty", 2: "Lesser",
-                                 3: "Common", 4: "Greater", 5: "Grand"
-                                }[unpack("uint8", field.data)]
-
+        super(SLGM, self).__init__(fd, type_, data)
         db['SLGM'][self.id] = self
 
     def __repr__(self):
@@ -1228,19 +1481,16 @@ _types["SLGM"] = SLGM
 
 
 class KEYM(Record):
-    def __init__(self, fd, type_="KEYM"):
-        super(KEYM, self).__init__(fd, type_)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": ("FullName", "lstring"),
+        "DATA": Layout(("Value", "uint32"), ("Weight", "float")),
+    })
+
+    def __init__(self, fd, type_="KEYM", data=None):
         self.effects = []
         self.FullName = "Unnamed"
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                self.FullName = unpack("lstring", field.data)
-            elif field.type == "DATA":
-                self.Value = unpack("uint32", field.data[:4])
-                self.Weight = unpack("float", field.data[4:])
-
+        super(KEYM, self).__init__(fd, type_, data)
         db['KEYM'][self.id] = self
 
     def __repr__(self):
@@ -1250,16 +1500,15 @@ _types["KEYM"] = KEYM
 
 
 class LIGH(Record):
-    def __init__(self, fd, type_="LIGH"):
-        super(LIGH, self).__init__(fd, type_)
-        self.FullName = "Unnamed"
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
-            elif field.type == "FULL":
-                self.FullName = unpack("lstring", field.data)
-            # Not really interested in LIGH objects except for Torch
+    # Not really interested in LIGH objects except for Torch
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+        "FULL": ("FullName", "lstring"),
+    })
 
+    def __init__(self, fd, type_="LIGH", data=None):
+        self.FullName = "Unnamed"
+        super(LIGH, self).__init__(fd, type_, data)
         db['MISC'][self.id] = self  # Adding to MISC database
 
     def __repr__(self):
@@ -1269,12 +1518,12 @@ _types["LIGH"] = LIGH
 
 
 class KYWD(Record):
-    def __init__(self, fd, type_="KYWD"):
-        super(KYWD, self).__init__(fd, type_)
-        for field in self.fields:
-            if field.type == "EDID":
-                self.EditorID = unpack("zstring", field.data)
+    _schema = compileSchema({
+        "EDID": ("EditorID", "zstring"),
+    })
 
+    def __init__(self, fd, type_="KYWD", data=None):
+        super(KYWD, self).__init__(fd, type_, data)
         db['KYWD'][self.id] = self  # Adding to MISC database
 
     def __repr__(self):
@@ -1284,11 +1533,34 @@ _types["KYWD"] = KYWD
 
 
 #%% Group
+_record_start = struct.Struct("<4sII")  # type, dataSize, flags
+
+
+def _compressedRecords(block):
+    """Find the compressed records in the data of a group.
+
+    Returns (offset, zlib payload, decompressed size) tuples. Records in
+    nested groups are left to the nested Group.
+    """
+    view = memoryview(block)
+    compressed = []
+    offset = 0
+    while offset + 24 <= len(block):
+        type_, size, flags = _record_start.unpack_from(block, offset)
+        if type_ == b"GRUP":
+            offset += size
+            continue
+        if flags & 0x00040000:
+            compressed.append((offset, view[offset+28:offset+24+size],
+                               _formid.unpack_from(block, offset + 24)[0]))
+        offset += 24 + size
+    return compressed
+
+
 class Group(object):
     def __init__(self, fd, type_="GRUP"):
         self.type = type_
         self.size = unpack("uint32", fd)
-        group_end = fd.tell() + self.size - 24
         self.label = fd.read(4).decode("cp1252")
         self.groupType = unpack("int32", fd)
         self.stamp = unpack("uint16", fd)
@@ -1297,38 +1569,111 @@ class Group(object):
         unpack("uint16", fd)  # Unknown
         records = []
         if self.label in _read_record_types:  # Only read some groups
-            while fd.tell() < group_end:
-                type_ = fd.read(4).decode("cp1252")
-#                data = BytesIO(fd.read(self.size - 24))
-
+            # Decompress all records in parallel, then decode them in order
+            block = fd.read(self.size - 24)
+            compressed = _compressedRecords(block)
+            results = decompressIter((data, size)
+                                     for offset, data, size in compressed)
+            compressed = iter(compressed)
+            next_compressed = next(compressed, (None,))[0]
+            block = Cursor(block)
+            while True:
+                offset = block.tell()
+                type_ = block.read(4).decode("cp1252")
                 if type_ == "":  # EOF
                     break
-                record = _read_record_types[type_](fd, type_)
+                if offset == next_compressed:
+                    record = _read_record_types[type_](block, type_,
+                                                       next(results))
+                    next_compressed = next(compressed, (None,))[0]
+                else:
+                    record = _read_record_types[type_](block, type_)
                 records.append(record)
-            self.records = records
         else:  # skip uninteresting groups
-#            fd.seek(fd.tell() + self.size - 24)
-            group_end = fd.tell() + self.size - 24
-            while fd.tell() < group_end:
-                type_ = fd.read(4).decode("cp1252")
-#                data = BytesIO(fd.read(self.size - 24))
+            fd.seek(self.size - 24, 1)
+        self.records = records
 
-                if type_ == "":  # EOF
-                    break
-                if type_ == "GRUP":
-                    fd.seek(group_end)
-                    continue
-                record = Record(fd, type_)
-                if record.id == 0x1D4EC:
-                    print(">>>>>>>>>>>>", record)
-#                records.append(record)
-#            self.records = records
     def __repr__(self):
         if self.type == "GRUP":
             return "{}:{}".format(self.type, self.label)
         return self.type
 
+_group_header = struct.Struct("<4sI4s")
+
+
+def indexGroups(fd):
+    """Index the top level groups of a plugin file.
+
+    Only the record and group headers are read, seeking past their contents
+    by size. Returns a list of (label, offset, size) for each group, the
+    offset being that of its "GRUP" type.
+    """
+    fd.seek(0, os.SEEK_END)
+    end = fd.tell()
+    fd.seek(0)
+    groups = []
+    offset = 0
+    while offset + _group_header.size <= end:
+        fd.seek(offset)
+        type_, size, label = _group_header.unpack(fd.read(_group_header.size))
+        if type_ == b"GRUP":
+            groups.append((label.decode("cp1252"), offset, size))
+        else:  # A record (TES4 header), size is that of its data
+            size += 24
+        offset += size
+    return groups
+
+
+def readGroups(fd, labels=None):
+    """Read the top level groups with the given labels from a plugin file.
+
+    `labels` defaults to the record types in _read_record_types. Other
+    groups are never touched, see indexGroups.
+    """
+    if labels is None:
+        labels = _read_record_types
+    for label, offset, size in indexGroups(fd):
+        if label in labels:
+            fd.seek(offset + 4)
+            yield Group(fd)
+
+
 _read_record_types = {'INGR': INGR, 'GRUP': Group, 'MGEF': MGEF, 'ALCH': ALCH,
                       'ENCH': ENCH, 'ARMO': ARMO, 'MISC': MISC, 'SCRL': SCRL,
                       'BOOK': BOOK, 'WEAP': WEAP, 'AMMO': AMMO, 'SLGM': SLGM,
                       'KEYM': KEYM, 'LIGH': LIGH, 'KYWD': KYWD}
+
+
+#%% Tests
+def test_inventory():
+    def refid(value, type_=0):
+        return struct.pack(">I", (type_ << 22) | value)[1:]
+
+    def item(value, count, extra=b""):
+        return refid(value) + struct.pack("<i", count) + extra
+
+    npc = b"\xff" * 7  # LeveledCreature NPC data, of unknown layout
+    leveled = refid(0x10) + refid(0x11)
+    inventory = [
+        item(1, 2, b"\x04\x04\x2d" + leveled + struct.pack("<I", 0)),
+        item(2, 1, b"\x04\x04\x2d" + leveled + struct.pack("<I", 0x800) +
+             npc),
+        item(3, 5, b"\x04\x04\x24\x64\x00"),  # Count
+        item(4, -1, b"\x00"),
+        item(5, 3, b"\x00")]
+    data = bytes(8) + bytes(bytearray([len(inventory) << 2]))
+    for entry in inventory:
+        data += entry
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        cf = ChangeForm.fromData(RefID.unpack_from(refid(0x14), 0), 0x20, 1,
+                                 1, data)
+    assert 'error' not in cf.d
+    assert len(caught) == 1
+    assert ([(inv_item.item.value, inv_item.itemcount)
+             for inv_item in cf.d['inventory']] ==
+            [(1, 2), (2, 1), (3, 5), (4, -1), (5, 3)])
+    extra = cf.d['inventory'][0].extraData[0].data[0]
+    assert extra.typeName == "LeveledCreature"
+    assert [ref.value for ref in extra.data[:2]] == [0x10, 0x11]
+    assert cf.d['inventory'][1].extraData is None
@@ -11,11 +11,16 @@ See LICENSE for details.
 
 from __future__ import unicode_literals
 
+import sys
 import struct
 from io import BytesIO
 from datetime import datetime
 import os.path as osp
 import pickle
+import mmap
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
 
 
 #%% unpack
@@ -42,6 +47,8 @@ _types = {
 
 
 def unpack(type_str, f):
+    if f.__class__ is Cursor:
+        return f.unpack(type_str)
     type_ = _types[type_str]
     if callable(type_):
         return type_(f)
@@ -55,6 +62,167 @@ def unpack(type_str, f):
         return tup
 
 
+#%% Cursor
+def _cursor_reader(st):
+    unpack_from = st.unpack_from
+    size = st.size
+
+    def read(self):
+        value = unpack_from(self.buf, self.pos)[0]
+        self.pos += size
+        return value
+    return read
+
+
+class Cursor(object):
+    """Decodes values from a buffer at a moving offset.
+
+    `buf` may be bytes, a bytearray, an mmap or a memoryview, and is never
+    copied. Besides one method per primitive type it has read, tell and
+    seek, so it can stand in for a file, and `unpack` uses the methods
+    directly when given a Cursor.
+    """
+    __slots__ = ('buf', 'pos')
+
+    def __init__(self, buf, pos=0):
+        self.buf = buf
+        self.pos = pos
+
+    def read(self, size=-1):
+        start = self.pos
+        end = len(self.buf)
+        if 0 <= size < end - start:
+            end = start + size
+        self.pos = end
+        return bytes(self.buf[start:end])
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += len(self.buf)
+        self.pos = pos
+        return pos
+
+    def unpack(self, type_str):
+        read = _cursor_types.get(type_str)
+        if read is not None:
+            return read(self)
+        type_ = _types[type_str]
+        if callable(type_):
+            return type_(self)
+        tup = type_.unpack(self.read(type_.size))
+        return tup[0] if len(tup) == 1 else tup
+
+    bool = _cursor_reader(_types["bool"])
+    char = _cursor_reader(_types["char"])
+    wchar = _cursor_reader(_types["wchar"])
+    int8 = _cursor_reader(_types["int8"])
+    int16 = _cursor_reader(_types["int16"])
+    uint16 = _cursor_reader(_types["uint16"])
+    int32 = _cursor_reader(_types["int32"])
+    uint32 = _cursor_reader(_types["uint32"])
+    int64 = _cursor_reader(_types["int64"])
+    uint64 = _cursor_reader(_types["uint64"])
+    float = _cursor_reader(_types["float"])
+    float64 = _cursor_reader(_types["float64"])
+
+    def uint8(self):
+        value = self.buf[self.pos]
+        self.pos += 1
+        return value
+
+    def vsval(self):
+        buf = self.buf
+        pos = self.pos
+        b1 = buf[pos]
+        length = b1 & 0x3
+        if length == 0:
+            self.pos = pos + 1
+            return b1 >> 2
+        elif length == 1:
+            self.pos = pos + 2
+            return (b1 | (buf[pos+1] << 8)) >> 2
+        elif length == 2:
+            self.pos = pos + 3
+            return (b1 | (buf[pos+1] << 8) | (buf[pos+2] << 16)) >> 2
+        else:
+            raise NotImplementedError("vsval type {} found: 0x{:x}".format(
+                length, b1))
+
+    def wstring(self):
+        string, self.pos = wstring_from(self.buf, self.pos)
+        return string
+
+    def zstring(self):
+        buf = self.buf
+        pos = self.pos
+        if hasattr(buf, "find"):
+            end = buf.find(b'\x00', pos)
+        else:  # memoryview
+            end = _findNull(buf, pos)
+        if end < 0:
+            raise ValueError("Unterminated zstring")
+        data = bytes(buf[pos:end])
+        self.pos = end + 1
+        try:
+            return data.decode('utf8')
+        except UnicodeDecodeError:
+            return data.decode('cp1252')
+
+    def lstring(self):
+        return get_lstring(self.uint32())
+
+    def filetime(self):
+        return filetime(self.uint64())
+
+    def RefID(self):
+        ref = RefID.unpack_from(self.buf, self.pos)
+        self.pos += 3
+        return ref
+
+
+def _findNull(buf, pos, chunk=256):
+    """buf.find(b'\\x00', pos), for buffers without find (memoryview)."""
+    size = len(buf)
+    while pos < size:
+        end = bytes(buf[pos:pos+chunk]).find(b'\x00')
+        if end >= 0:
+            return pos + end
+        pos += chunk
+    return -1
+
+
+_cursor_types = {
+    "bool": Cursor.bool,
+    "char": Cursor.char,
+    "wchar": Cursor.wchar,
+    "int8": Cursor.int8,
+    "uint8": Cursor.uint8,
+    "int16": Cursor.int16,
+    "uint16": Cursor.uint16,
+    "int32": Cursor.int32,
+    "uint32": Cursor.uint32,
+    "int64": Cursor.int64,
+    "uint64": Cursor.uint64,
+    "float": Cursor.float,
+    "float32": Cursor.float,
+    "float64": Cursor.float64,
+    "formid": Cursor.uint32,
+    "iref": Cursor.uint32,
+    "hash": Cursor.uint64,
+    "wstring": Cursor.wstring,
+    "zstring": Cursor.zstring,
+    "lstring": Cursor.lstring,
+    "vsval": Cursor.vsval,
+    "filetime": Cursor.filetime,
+    "RefID": Cursor.RefID,
+}
+
+
 #%% wstring
 def wstring(f):
     size = unpack("uint16", f)
@@ -64,6 +232,20 @@ def wstring(f):
         return f.read(size).decode('cp1252')
 _types["wstring"] = wstring
 
+
+def wstring_from(buf, offset):
+    """Decode a wstring at `offset` of a buffer (e.g. a memoryview).
+
+    Returns the string and the offset just after it.
+    """
+    size = _types["uint16"].unpack_from(buf, offset)[0]
+    offset += 2
+    data = bytes(buf[offset:offset+size])
+    try:
+        return data.decode('utf8'), offset + size
+    except UnicodeDecodeError:
+        return data.decode('cp1252'), offset + size
+
 #%% zstring
 def zstring(f):
     if isinstance(f, str) or isinstance(f, bytes):
@@ -71,11 +253,19 @@ def zstring(f):
             return f[:-1].decode('utf8')
         except:
             return f[:-1].decode('cp1252')
+    # Read in chunks and seek back to just after the terminator
     bs = []
-    b = f.read(1)
-    while b != b'\x00':
-        bs.append(b)
-        b = f.read(1)
+    while True:
+        start = f.tell()
+        chunk = f.read(256)
+        end = chunk.find(b'\x00')
+        if end >= 0:
+            bs.append(chunk[:end])
+            f.seek(start + end + 1)
+            break
+        if not chunk:
+            break
+        bs.append(chunk)
     ret = b''.join(bs)
     try:
         return ret.decode('utf8')
@@ -84,26 +274,175 @@ def zstring(f):
 
 _types["zstring"] = zstring
 
+
+def zstring_from(buf, offset):
+    """Decode a zstring at `offset` of a buffer.
+
+    Returns the string and the offset just after its terminator.
+    """
+    cursor = Cursor(buf, offset)
+    return cursor.zstring(), cursor.pos
+
 #%% lstring
+_lstrings_magic = b"SKYALCHS"
+_lstrings_version = 1
+_lstrings_header = struct.Struct("<8sH2xI")  # magic, version, count
+
+
+def saveStringTable(strings, filename):
+    """Save a {string ID: string} dict as a string table file.
+
+    The file holds the sorted uint32 IDs, uint32 offsets of each string
+    (plus the end of the last one) and all strings in one blob. Numbers are
+    little-endian. Strings may also be given as undecoded bytes.
+    """
+    ids = array("I", sorted(strings))
+    offsets = array("I", [0])
+    blob = []
+    for id_ in ids:
+        string = strings[id_]
+        if not isinstance(string, bytes):
+            string = string.encode("utf8")
+        blob.append(string)
+        offsets.append(offsets[-1] + len(string))
+    if sys.byteorder == "big":
+        ids.byteswap()
+        offsets.byteswap()
+    with open(filename, "wb") as f:
+        f.write(_lstrings_header.pack(_lstrings_magic, _lstrings_version,
+                                      len(ids)))
+        f.write(ids.tobytes())
+        f.write(offsets.tobytes())
+        f.write(b"".join(blob))
+
+
+class StringTable(object):
+    """A memory-mapped string table file (see saveStringTable).
 
-lstrings_file = osp.join("data", "lstrings.pkl")
-if osp.exists(lstrings_file):
-    with open(lstrings_file, 'rb') as f:
-        lstrings = pickle.load(f)
-else:
-    lstrings = {}
+    Strings are found by binary search of the ID array and decoded only
+    when looked up.
+    """
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = _lstrings_header.unpack_from(self.mm)
+        if magic != _lstrings_magic or version != _lstrings_version:
+            raise ValueError("Unsupported string table file")
+        buf = memoryview(self.mm)
+        start = _lstrings_header.size
+        self.ids = self._uint32s(buf[start:start+4*count])
+        start += 4*count
+        self.offsets = self._uint32s(buf[start:start+4*(count+1)])
+        self.blob = start + 4*(count+1)
+
+    @staticmethod
+    def _uint32s(buf):
+        """Little-endian uint32 array, in place unless it must be swapped."""
+        if sys.byteorder == "little":
+            return buf.cast("I")
+        values = array("I", bytes(buf))
+        values.byteswap()
+        return values
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _index(self, id_):
+        i = bisect_left(self.ids, id_)
+        if i == len(self.ids) or self.ids[i] != id_:
+            raise KeyError(id_)
+        return i
+
+    def __contains__(self, id_):
+        try:
+            self._index(id_)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, id_):
+        i = self._index(id_)
+        data = self.mm[self.blob+self.offsets[i]:self.blob+self.offsets[i+1]]
+        try:
+            return data.decode("utf8")
+        except UnicodeDecodeError:
+            return data.decode("cp1252")
+
+
+class LocalizedStrings(object):
+    """Localized strings by ID.
+
+    Strings come from the string table file, which is only opened on the
+    first lookup, through a small LRU cache. Strings set here (e.g. with
+    update) take precedence. A string table in the older pickle format is
+    converted the first time.
+    """
+    def __init__(self, filename, cache_size=4096):
+        self.filename = filename
+        self.strings = {}
+        self.table = None
+        self._lookup = lru_cache(cache_size)(self._lookupTable)
+
+    def open(self):
+        """Open the string table file, if it exists. Returns it or None."""
+        if self.table is None:
+            if not osp.exists(self.filename):
+                pickle_file = osp.splitext(self.filename)[0] + ".pkl"
+                if not osp.exists(pickle_file):
+                    return None
+                with open(pickle_file, "rb") as f:
+                    saveStringTable(pickle.load(f), self.filename)
+            self.table = StringTable(self.filename)
+        return self.table
+
+    def _lookupTable(self, id_):
+        table = self.open()
+        if table is None:
+            raise KeyError(id_)
+        return table[id_]
+
+    def reload(self):
+        """Forget the string table, e.g. after it was extracted again."""
+        self.table = None
+        self._lookup.cache_clear()
+
+    def __getitem__(self, id_):
+        try:
+            return self.strings[id_]
+        except KeyError:
+            return self._lookup(id_)
+
+    def __setitem__(self, id_, string):
+        self.strings[id_] = string
+
+    def __contains__(self, id_):
+        if id_ in self.strings:
+            return True
+        table = self.open()
+        return table is not None and id_ in table
+
+    def update(self, strings):
+        self.strings.update(strings)
+
+lstrings = LocalizedStrings(osp.join("data", "lstrings.idx"))
+
+
+def get_lstring(id_):
+    try:
+        return lstrings[id_]
+    except KeyError:
+        return "Unknown string: 0x{:08d}".format(id_)
 
 
 def lstring(f):
-    id_ = unpack("uint32", f)
-    return lstrings.get(id_, "Unknown string: 0x{:08d}".format(id_))
+    return get_lstring(unpack("uint32", f))
 
 _types["lstring"] = lstring
 
 #%% vsval
 def vsval(f):
     if not getattr(f, "read", False):  # Probably string
-        f = BytesIO(f)
+        return Cursor(f).vsval()
     b1 = unpack("uint8", f)
     length = b1 & 0x3
     if length == 0:
@@ -135,17 +474,24 @@ unvsval(0x04f8)
 _EPOCH_AS_FILETIME = 116444736000000000
 _HUNDREDS_OF_NANOSECONDS = 10000000
 
-def read_filetime(f):
-    ns100_1601 = struct.unpack("<Q", f.read(8))[0]
+def filetime(ns100_1601):
+    """Convert a Windows FILETIME (100 ns since 1601) to a datetime."""
     (s, ns100_rem) = divmod(ns100_1601 - _EPOCH_AS_FILETIME,
                             _HUNDREDS_OF_NANOSECONDS)
     dt = datetime.utcfromtimestamp(s)
     dt = dt.replace(microsecond=(ns100_rem // 10))
     return dt
+
+
+def read_filetime(f):
+    return filetime(struct.unpack("<Q", f.read(8))[0])
 _types["filetime"] = read_filetime
 
 
 #%% RefID
+_refid = struct.Struct(">BH")
+
+
 class RefID(object):
     formid = {}
     defaultid = {}
@@ -153,8 +499,7 @@ class RefID(object):
     __nameless = None
     def __init__(self, fd):
         try:
-            first = unpack("uint8", fd)
-            rest = struct.Struct('>H').unpack(fd.read(2))[0]
+            first, rest = _refid.unpack(fd.read(3))
             self.type_ = first >> 6
             self.value = (first & 0x3f) << 16 ^ rest
         except:  # Maybe it's a number?
@@ -170,6 +515,16 @@ class RefID(object):
 
         self.type = {0: "F", 1: "D", 2: "C", 3: "U"}[self.type_]
 
+    @classmethod
+    def unpack_from(cls, buf, offset):
+        """Decode a RefID at `offset` of a buffer."""
+        first, rest = _refid.unpack_from(buf, offset)
+        ref = cls.__new__(cls)
+        ref.type_ = first >> 6
+        ref.value = (first & 0x3f) << 16 ^ rest
+        ref.type = "FDCU"[ref.type_]
+        return ref
+
     @property
     def name(self):
         if self.type_ == 0:
@@ -188,3 +543,65 @@ class RefID(object):
             return "RefID<{}:{:08X}:{}>".format(self.type, self.value, self.name)
 _types["RefID"] = RefID
 
+
+#%% Tests
+def test_cursor():
+    data = (b"ab\x00" + b"x" * 600 + b"\x00" + b"\x07\x00\x00\x00abc" +
+            b"\x05\x00hello")
+    for buf in (data, bytearray(data), memoryview(data)):
+        cursor = Cursor(buf)
+        assert cursor.zstring() == "ab"
+        assert unpack("zstring", cursor) == "x" * 600
+        assert unpack("uint32", cursor) == 7
+        assert unpack("char", cursor) == b"a"
+        assert cursor.unpack("wchar") == b"bc"
+        assert unpack("wstring", cursor) == "hello"
+        assert cursor.tell() == len(data)
+    try:
+        Cursor(memoryview(b"abc")).zstring()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Unterminated zstring should fail")
+
+
+def test_stringtable():
+    import shutil
+    import tempfile
+    strings = {0x10: "Imp Stool", 0x2: "", 0xFFFFFFFF: "Élan",
+               0x7: b"caf\xe9", 0x8: "x" * 1000}
+    folder = tempfile.mkdtemp()
+    try:
+        filename = osp.join(folder, "lstrings.idx")
+        saveStringTable(strings, filename)
+        with open(filename, "rb") as f:
+            data = f.read()
+        start = _lstrings_header.size
+        assert struct.unpack_from("<5I", data, start) == (
+            0x2, 0x7, 0x8, 0x10, 0xFFFFFFFF)  # Sorted, little-endian
+        table = StringTable(filename)
+        assert len(table) == 5
+        assert table[0x10] == "Imp Stool"
+        assert table[0x2] == ""
+        assert table[0xFFFFFFFF] == "Élan"
+        assert table[0x7] == "café"  # cp1252 fallback
+        assert table[0x8] == "x" * 1000
+        assert 0x11 not in table and 0x10 in table
+        try:
+            table[0x11]
+        except KeyError:
+            pass
+        else:
+            raise AssertionError("Missing IDs should raise KeyError")
+
+        localized = LocalizedStrings(filename, cache_size=2)
+        localized.update({0x10: "Overridden"})
+        assert localized[0x10] == "Overridden"
+        assert localized[0x8] == "x" * 1000
+        assert 0x7 in localized and 0x11 not in localized
+        localized.filename = osp.join(folder, "new.idx")
+        saveStringTable({0x8: "y"}, localized.filename)
+        localized.reload()
+        assert localized[0x8] == "y"
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
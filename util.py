@@ -17,6 +17,7 @@ import os
 import os.path as osp
 import argparse
 import inspect
+import multiprocessing
 from subprocess import Popen, call
 
 #%% Commands
@@ -76,9 +77,115 @@ def cmd_translate(lang=None):
     exe = osp.join(sys.exec_prefix, "Library", "bin", "lrelease")
     call([exe, tsfile, "-qm", osp.join("data", qmfile)])
 
+def cmd_batch(path=None, output=None, skill=None, fortify=None, perks=None,
+              top=None, workers=None):
+    """Analyze a directory of savegames, writing a JSON line per savegame
+        Optional arguments:
+            --path PATH - Directory with .ess files [defaults to savegame directory]
+            --output FILE - JSON lines output file [defaults to standard output]
+            --skill SKILL - Alchemy skill [defaults to 100]
+            --fortify FORTIFY - Fortify Alchemy bonus [defaults to 0]
+            --perks PERKS - Comma-separated perks: alchemist1-5, physician,
+                            benefactor, poisoner, purity [defaults to none]
+            --top TOP - Number of best recipes per savegame [defaults to 10]
+            --workers WORKERS - Number of processes [defaults to CPU count]"""
+    import json
+    from concurrent.futures import ProcessPoolExecutor
+    import savegame
+    if path is None:
+        path = savegame.getSaveDir()
+    perk_ids = set()
+    for name in (perks or "").split(","):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in _perk_ids:
+            print("Invalid perk: {}\nValid perks: {}".format(
+                name, ", ".join(sorted(_perk_ids))))
+            sys.exit(-2)
+        perk_ids.add(_perk_ids[name])
+    filenames = sorted(osp.join(path, f) for f in os.listdir(path)
+                       if f.endswith(".ess"))
+    workers = int(workers) if workers else None
+    out = open(output, 'w') if output else sys.stdout
+    try:
+        with ProcessPoolExecutor(workers, initializer=_initBatchWorker,
+                                 initargs=(float(skill or 100),
+                                           float(fortify or 0), perk_ids,
+                                           int(top or 10))) as pool:
+            for row in pool.map(_analyzeSavegame, filenames):
+                out.write(json.dumps(row) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+#%% Batch workers
+_perk_ids = {
+    "alchemist1": 0xbe127,
+    "alchemist2": 0xc07ca,
+    "alchemist3": 0xc07cb,
+    "alchemist4": 0xc07cc,
+    "alchemist5": 0xc07cd,
+    "physician": 0x58215,
+    "benefactor": 0x58216,
+    "poisoner": 0x58217,
+    "purity": 0x5821d,
+}
+_batch = {}
+
+
+def _initBatchWorker(skill, fortify, perks, top):
+    import savegame
+    _batch.update(skill=skill, fortify=fortify, perks=perks, top=top,
+                  cache=savegame.SavegameCache(), loaded=False)
+
+
+def _analyzeSavegame(filename):
+    """Inventory ingredients and best recipes of a savegame, as a dict."""
+    import savegame
+    import alchemy
+    import skyrimdata
+    from skyrimdata import db
+    try:
+        if not _batch['loaded']:  # Here, so a failure is reported per file
+            skyrimdata.loadData()  # Once per process
+            _batch['loaded'] = True
+        sg = savegame.Savegame(filename, profile="ingredients",
+                               cache=_batch['cache'])
+        sg.populate_ids()
+        counts = {}
+        for count, formid in sg.player_ingrs():
+            counts[formid] = counts.get(formid, 0) + count
+        ingrs = [db['INGR'][formid] for formid in counts]
+        factory = alchemy.RecipeFactory(ingrs)
+        recipes = factory.calcRecipes(_batch['skill'], _batch['fortify'],
+                                      _batch['perks'], unique=True)
+    except Exception as e:  # Report it and go on with the other savegames
+        return {"file": filename,
+                "error": "{}: {}".format(type(e).__name__, e)}
+    return {
+        "file": filename,
+        "player": sg.d['playerName'],
+        "level": sg.d['playerLevel'],
+        "saveNumber": sg.d['saveNumber'],
+        "ingredients": [{"formid": "{:08X}".format(ingr.id),
+                         "name": ingr.FullName, "count": counts[ingr.id]}
+                        for ingr in factory.ingrs],
+        "recipes": [{"name": recipe.Name, "value": recipe.Value,
+                     "ingredients": [ingr.FullName for ingr in recipe.ingrs],
+                     "effects": [{"name": ef.MGEF.FullName,
+                                  "magnitude": ef.Magnitude,
+                                  "duration": ef.Duration}
+                                 for ef in recipe.effects]}
+                    for recipe in recipes[:_batch['top']]],
+    }
+
 #%% Main execution
 # Runs when executing script directly (not importing).
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     ### Find commands from local variables
     cmds = {}
     max_len = 0